@@ -5,9 +5,11 @@ Different backends allow for different ways to handle the data from NASA.
 
 from abc import ABC
 from collections import OrderedDict
+from functools import cached_property
 import logging
 import os
 import re
+import threading
 
 import xarray as xr
 
@@ -22,6 +24,14 @@ except:
     S3FS_AVAILABLE = False
     module_logger.debug("s3fs library is not available")
 
+try:
+    import dask
+
+    DASK_AVAILABLE = True
+except:
+    DASK_AVAILABLE = False
+    module_logger.debug("dask library is not available")
+
 
 class BaseStorage(ABC):
     """Base class for storage backends
@@ -96,7 +106,13 @@ class FileSystem:
         filename = self.path(key)
         try:
             self.logger.debug(f"Openning file: {filename}")
-            ds = xr.open_dataset(filename)
+            # Explicit engine to skip the format guessing, and lazy load
+            # with dask if available.
+            ds = xr.open_dataset(
+                filename,
+                engine="h5netcdf",
+                chunks={} if DASK_AVAILABLE else None,
+            )
         except FileNotFoundError:
             raise KeyError
         return ds
@@ -215,6 +231,16 @@ class S3Storage(BaseStorage):
         return p.replace(".nc", ".zarr")
 
 
+# Mission of each platform code in NASA's filenames, see Filename.mission
+_PLATFORM_MISSION = {
+    "S": "SeaWIFS",
+    "AQUA_MODIS": "MODIS-Aqua",
+    "TERRA_MODIS": "MODIS-Terra",
+    "JPSS1_VIIRS": "VIIRS-JPSS1",
+    "SNPP_VIIRS": "VIIRS-SNPP",
+}
+
+
 class Filename:
     """Parse implicit information on NASA's filename
 
@@ -242,22 +268,11 @@ class Filename:
         self.filename = filename
         self.attrs = parse_filename(filename)
 
-    @property
+    @cached_property
     def mission(self):
-        attrs = self.attrs
-
-        if attrs["platform"] == "S":
-            return "SeaWIFS"
-        elif attrs["platform"] == "AQUA_MODIS":
-            return "MODIS-Aqua"
-        elif attrs["platform"] == "TERRA_MODIS":
-            return "MODIS-Terra"
-        elif attrs["platform"] == "JPSS1_VIIRS":
-            return "VIIRS-JPSS1"
-        elif attrs["platform"] == "SNPP_VIIRS":
-            return "VIIRS-SNPP"
+        return _PLATFORM_MISSION.get(self.attrs["platform"])
 
-    @property
+    @cached_property
     def dirname(self):
         path = os.path.join(
             self.mission,
@@ -268,11 +283,37 @@ class Filename:
         )
         return path
 
-    @property
+    @cached_property
     def path(self):
         return os.path.join(self.dirname, self.filename)
 
 
+# Compiled once for all the filenames, see parse_filename()
+_FILENAME_RULE = re.compile(
+    r"""
+    (?P<platform>S|(?:SNPP_VIIRS)|(?:JPSS1_VIIRS)|(?:AQUA_MODIS)|(?:TERRA_MODIS))
+    .
+    (?P<year>\d{4})
+    (?P<month>\d{2})
+    (?P<day>\d{2})
+    (?:
+      T
+      (?P<hour>\d{2})
+      (?P<minute>\d{2})
+      (?P<second>\d{2})
+    )?
+    .
+    (?P<mode>(L2)|(L3m))
+    (?:.DAY)?
+    .
+    (?P<instrument>(?:SNPP)|(?:JPSS1))?
+    .*?
+    \.nc
+    """,
+    re.VERBOSE,
+)
+
+
 def parse_filename(filename: str):
     """Parse an OceanColor data filename
 
@@ -303,27 +344,7 @@ def parse_filename(filename: str):
       - V2015009.L3m_DAY_SNPP_CHL_chlor_a_4km.nc
       - V2018006230000.L2_JPSS1_OC.nc
     """
-    rule = r"""
-        (?P<platform>S|(?:SNPP_VIIRS)|(?:JPSS1_VIIRS)|(?:AQUA_MODIS)|(?:TERRA_MODIS))
-        .
-        (?P<year>\d{4})
-        (?P<month>\d{2})
-        (?P<day>\d{2})
-        (?:
-          T
-          (?P<hour>\d{2})
-          (?P<minute>\d{2})
-          (?P<second>\d{2})
-        )?
-        .
-        (?P<mode>(L2)|(L3m))
-        (?:.DAY)?
-        .
-        (?P<instrument>(?:SNPP)|(?:JPSS1))?
-        .*?
-        \.nc
-        """
-    output = re.match(rule, filename, re.VERBOSE).groupdict()
+    output = _FILENAME_RULE.match(filename).groupdict()
     return output
 
 
@@ -335,8 +356,6 @@ class InMemory(BaseStorage):
 
     logger = logging.getLogger("OceanColor.backend.InMemory")
 
-    __data = OrderedDict()
-
     def __init__(self, quota: int = 5 * 1024**3):
         """Initialize an InMemory object
 
@@ -347,26 +366,36 @@ class InMemory(BaseStorage):
             the oldest item stored is deleted.
         """
         self.quota = quota
+        # Each instance has its own storage and quota
+        self.__data = OrderedDict()
+        # Total bytes in __data, kept up to date on every change
+        self.__nbytes = 0
+        # Granules are fetched concurrently (see InRange._fetch), thus the
+        # storage and its total must be changed by one thread at a time
+        self.__lock = threading.RLock()
 
     def __contains__(self, index):
         return index in self.__data
 
     def __getitem__(self, index):
-        if index in self:
-            self.__data.move_to_end(index)
-        return self.__data[index]
+        with self.__lock:
+            if index in self:
+                self.__data.move_to_end(index)
+            return self.__data[index]
 
     def __setitem__(self, index, ds):
         assert isinstance(ds, xr.Dataset)
-        self.__data[index] = ds
-        self.apply_quota()
+        with self.__lock:
+            if index in self.__data:
+                self.__nbytes -= int(self.__data[index].nbytes)
+            self.__data[index] = ds
+            self.__nbytes += int(ds.nbytes)
+            self.apply_quota()
 
     @property
     def nbytes(self):
         """Total bytes stored"""
-        if len(self.__data) == 0:
-            return 0
-        return int(round(sum([v.nbytes for v in self.__data.values()])))
+        return self.__nbytes
 
     def apply_quota(self):
         """Verify quota and remove old objects if necessary
@@ -374,5 +403,7 @@ class InMemory(BaseStorage):
         The most recently acessed objects have priority, thus the oldest
         objects are removed first.
         """
-        while (len(self.__data) > 1) and (self.nbytes > self.quota):
-            self.__data.popitem(last=False)
+        with self.__lock:
+            while (len(self.__data) > 1) and (self.nbytes > self.quota):
+                _, ds = self.__data.popitem(last=False)
+                self.__nbytes -= int(ds.nbytes)
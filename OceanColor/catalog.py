@@ -1,7 +1,7 @@
 """Main module."""
 
 import logging
-import os
+from operator import itemgetter
 from typing import Any, Dict, Optional
 from collections.abc import Sequence
 
@@ -11,6 +11,16 @@ import pandas as pd
 
 module_logger = logging.getLogger("OceanColor.catalog")
 
+# Columns required to search the catalog, see Catalog.bloom_filter
+COVERAGE_COLUMNS = [
+    "time_coverage_start",
+    "time_coverage_end",
+    "geospatial_lat_min",
+    "geospatial_lat_max",
+    "geospatial_lon_min",
+    "geospatial_lon_max",
+]
+
 
 def ds_attrs(ds):
     attributes = [
@@ -25,13 +35,15 @@ def ds_attrs(ds):
         "geospatial_lon_min",
         "geospatial_lon_max",
     ]
-    output = {}
-    for a in attributes:
-        output[a] = ds.attrs[a]
+    output = dict(zip(attributes, itemgetter(*attributes)(ds.attrs)))
 
-    for a in ("date_created", "time_coverage_start", "time_coverage_end"):
-        assert output[a][-1] == "Z"
-        output[a] = np.datetime64(output[a][:-1])
+    # All timestamps are parsed by NumPy at once
+    timestamps = ("date_created", "time_coverage_start", "time_coverage_end")
+    assert all(output[a].endswith("Z") for a in timestamps)
+    values = np.array(
+        [output[a][:-1] for a in timestamps], dtype="datetime64[ms]"
+    )
+    output.update(zip(timestamps, values))
 
     return output
 
@@ -50,9 +62,15 @@ class Catalog:
     """
 
     def __init__(self, dbfilename):
+        # A light and fast compression, since the catalog is appended
+        # frequently and is small anyway.
         self.store = pd.HDFStore(
-            dbfilename, mode="a", complevel=9, fletcher32=True
+            dbfilename, mode="a", complib="blosc:lz4", complevel=3
         )
+        # Product names in the catalog, see product_names
+        self._product_names = None
+        # Time and space coverage of each granule, see coverage
+        self._coverage = None
 
     def __getitem__(self, product_name):
         record = self.store.select("catalog", f"index == '{product_name}'")
@@ -62,21 +80,43 @@ class Catalog:
         return record
 
     def __contains__(self, product_name):
-        try:
-            return self[product_name].size > 0
-        except KeyError:
-            # assert 'catalog' not in self.store
-            return False
+        return product_name in self.product_names
 
-        ans = ("catalog" in self.store) and self.store.select(
-            "catalog",
-            where="product_name='%s'" % os.path.basename(product_name),
-            columns=["product_name"],
-        ).size > 0
-        return ans
+    @property
+    def product_names(self):
+        """Set of product names recorded in the catalog
+
+        Loaded from the store only once, on the first use, and then kept up
+        to date by record(), so that checking if a granule was already
+        recorded doesn't require a query on the store.
+        """
+        if self._product_names is None:
+            if "catalog" in self.store:
+                self._product_names = set(
+                    self.store.select_column("catalog", "index")
+                )
+            else:
+                self._product_names = set()
+        return self._product_names
+
+    @property
+    def coverage(self):
+        """Time and space coverage of each granule in the catalog
+
+        Loaded from the store on the first use after any change, so that
+        consecutive searches are evaluated in memory.
+        """
+        if self._coverage is None:
+            self._coverage = self.store.select(
+                "catalog", columns=COVERAGE_COLUMNS
+            )
+        return self._coverage
 
     def __setitem__(self, key, value):
         self.store.append("catalog", value, format="t", data_columns=True)
+        # Reload the product names and coverage on the next use
+        self._product_names = None
+        self._coverage = None
 
     def __del__(self):
         module_logger.debug(
@@ -89,22 +129,42 @@ class Catalog:
         """
         min_itemsize={'values': 42}
         """
-        attrs = ds_attrs(ds)
-        assert attrs["product_name"] not in self, (
-            "There is a record in the database for %s" % attrs["filename"]
-        )
-        module_logger.debug(f"New record: {attrs}")
-        attrs = pd.DataFrame([attrs])
-        attrs = attrs.set_index("product_name")
-        # if ('catalog' in self.store):
-        #     tmp = tmp.set_index(tmp.index + self.store.catalog.index.max() + 1)
+        self.record_many([ds])
+
+    def record_many(self, datasets):
+        """Record multiple granules at once
+
+        All records are appended to the store in a single operation, which
+        is much cheaper than one append for each granule.
+
+        Parameters
+        ----------
+        datasets : sequence of xr.Dataset
+            Granules not recorded yet
+        """
+        records = []
+        for ds in datasets:
+            attrs = ds_attrs(ds)
+            assert attrs["product_name"] not in self, (
+                "There is a record in the database for %s"
+                % attrs["product_name"]
+            )
+            module_logger.debug(f"New record: {attrs}")
+            records.append(attrs)
+        if len(records) == 0:
+            return
+
+        records = pd.DataFrame(records).set_index("product_name")
+        assert records.index.is_unique, "Repeated granules to record"
         self.store.append(
             "catalog",
-            attrs,
+            records,
             format="t",
             data_columns=True,
             min_itemsize={"values": 42},
         )
+        self.product_names.update(records.index)
+        self._coverage = None
 
     def bloom_filter(
         self,
@@ -119,14 +179,22 @@ class Catalog:
         bloom_filter(track, dt_tol, dL_tol)
         """
 
-        cond = []
-        cond.append("time_coverage_end >= %r" % (track.time.min() - dt_tol))
-        cond.append("time_coverage_start <= %r" % (track.time.max() + dt_tol))
-        cond.append(f"geospatial_lat_max > {track.lat.min()}")
-        cond.append(f"geospatial_lat_min > {track.lat.max()}")
-        cond.append(
-            "(geospatial_lon_min <= {} & geospatial_lon_max >= {}) or (geospatial_lon_max < 0 & geospatial_lon_min > 0)".format(
-                track.lon.max(), track.lon.min()
+        if "catalog" not in self.store:
+            return
+
+        # Evaluated in memory at once instead of row by row in the store
+        c = self.coverage
+        mask = (
+            (c.time_coverage_end >= track.time.min() - dt_tol)
+            & (c.time_coverage_start <= track.time.max() + dt_tol)
+            & (c.geospatial_lat_max > track.lat.min())
+            & (c.geospatial_lat_min < track.lat.max())
+            & (
+                (
+                    (c.geospatial_lon_min <= track.lon.max())
+                    & (c.geospatial_lon_max >= track.lon.min())
+                )
+                | ((c.geospatial_lon_max < 0) & (c.geospatial_lon_min > 0))
             )
         )
-        yield from self.store.select("catalog", where=cond).index
+        yield from c.index[mask.values]
@@ -1,19 +1,41 @@
 """Support to NASA's Common Metadata Repository
 """
 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import logging
+from math import cos, radians
+import threading
+import time
 from typing import Any, Dict, Optional
 from collections.abc import Sequence
 
 from numpy import datetime64, datetime_as_string
 import re
-import requests
-from cmr import GranuleQuery
+
+from .utils import json_loads, requests_session
 
 module_logger = logging.getLogger(__name__)
 
+# Maximum number of concurrent requests to CMR
+CMR_WORKERS = 8
+
+# Shared by all requests to CMR, thus reusing its connections
+_cmr_session = requests_session(pool_maxsize=CMR_WORKERS)
+
+# Largest side, in degrees, of a bounding box searched at once instead of
+# each waypoint individually, see _bounding_box()
+BBOX_MAX_SIZE = 2.0
+
+# Maximum number of recent searches kept in memory, and for how long, in
+# seconds, see _granules_list()
+CMR_CACHE_SIZE = 1024
+CMR_CACHE_TTL = 60 * 60
+_cmr_cache = OrderedDict()
+_cmr_cache_lock = threading.Lock()
+
 
-def api_walk(url, page_size=25, offset=0, **kwargs):
+def api_walk(url, page_size=2000, offset=0, **kwargs):
     """Walk through outputs from CMR API
 
     Iterate on NASA's Common Metadata Repository API output.
@@ -23,7 +45,8 @@ def api_walk(url, page_size=25, offset=0, **kwargs):
     url : str
         CMR's API endpoint
     page_size : int, optional
-        Number of results per page
+        Number of results per page. Default is CMR's maximum, 2000, thus the
+        least number of requests.
     offset : int, optional
         Skip the offset number of results. Useful when rolling between pages
 
@@ -43,29 +66,50 @@ def api_walk(url, page_size=25, offset=0, **kwargs):
     >>> for r in api_walk(src, page_size=2, **params):
     >>>     print(r)
 
+    Both the UMM (.umm_json) and the lighter Atom (.json) formats are
+    supported.
     """
     kwargs["page_size"] = page_size
     kwargs["offset"] = offset
-    module_logger.debug(f"api_walk() with kwargs: {kwargs}")
-    r = requests.get(url, params=kwargs)
-    if r.status_code != 200:
-        module_logger.warning(f"Failed {r.status_code}")
-    assert r.status_code == 200
-    content = r.json()
-    yield from content["items"]
-
-    kwargs["offset"] += len(content["items"])
-    if kwargs["offset"] < content["hits"]:
-        yield from api_walk(url, **kwargs)
+    while True:
+        module_logger.debug(f"api_walk() with kwargs: {kwargs}")
+        r = _cmr_session.get(url, params=kwargs, timeout=60)
+        if r.status_code != 200:
+            module_logger.warning(f"Failed {r.status_code}")
+        assert r.status_code == 200
+        content = json_loads(r.content)
+        if "feed" in content:
+            # Atom format, with the total hits in the headers
+            items = content["feed"]["entry"]
+            hits = int(r.headers["CMR-Hits"])
+        else:
+            items = content["items"]
+            hits = content["hits"]
+        yield from items
+
+        kwargs["offset"] += len(items)
+        if (len(items) == 0) or (kwargs["offset"] >= hits):
+            break
 
 
 def granules_search(
-    short_name, provider, temporal, circle, sort_key="start_date"
+    short_name,
+    provider,
+    temporal,
+    circle=None,
+    sort_key=None,
+    bounding_box=None,
 ):
     """
 
     Maybe rename to filename_search
 
+    The search region is either a circle ("lon,lat,radius") or a
+    bounding_box ("W,S,E,N").
+
+    The results are sorted only if requested with sort_key, such as
+    "start_date", since sorting has a cost for CMR.
+
     Examples
     --------
     params = {
@@ -85,21 +129,69 @@ def granules_search(
     - Should I use 'DIRECT DOWNLOAD' or 'GET DATA' fields and yield URL
       instead?
     """
-    url = "https://cmr.earthdata.nasa.gov/search/granules.umm_json"
+    # The Atom format is lighter than UMM and still includes the
+    # producer_granule_id
+    url = "https://cmr.earthdata.nasa.gov/search/granules.json"
 
     params = {
         "short_name": short_name,
         "provider": provider,
-        "sort_key": sort_key,
         "temporal": temporal,
-        "circle": circle,
+        "downloadable": "true",
     }
-    api = GranuleQuery()
-    api.params = params
-    granules = api.downloadable().get()
-    print([g["producer_granule_id"] for g in granules])
-    for granule in api.get():
-        yield granule["producer_granule_id"]
+    if circle is not None:
+        params["circle"] = circle
+    if bounding_box is not None:
+        params["bounding_box"] = bounding_box
+    if sort_key is not None:
+        params["sort_key"] = sort_key
+    for result in api_walk(url, **params):
+        yield result["producer_granule_id"]
+
+
+def _granules_list(**kwargs):
+    """All the results of granules_search() at once
+
+    The results of recent searches are kept in memory for up to
+    CMR_CACHE_TTL seconds, so that repeated searches, such as the same
+    waypoint on consecutive calls, don't reach CMR again.
+    """
+    key = tuple(sorted(kwargs.items()))
+    with _cmr_cache_lock:
+        if key in _cmr_cache:
+            searched, granules = _cmr_cache[key]
+            if (time.time() - searched) < CMR_CACHE_TTL:
+                _cmr_cache.move_to_end(key)
+                return granules
+
+    granules = tuple(granules_search(**kwargs))
+
+    with _cmr_cache_lock:
+        _cmr_cache[key] = (time.time(), granules)
+        _cmr_cache.move_to_end(key)
+        while len(_cmr_cache) > CMR_CACHE_SIZE:
+            _cmr_cache.popitem(last=False)
+    return granules
+
+
+# CMR collection, and filename rule if needed, for each (sensor, dtype)
+CMR_SEARCH_CRITERIA = {
+    ("seawifs", "L2"): {"short_name": "SEAWIFS_L2_OC", "provider": "OB_DAAC"},
+    ("snpp", "L2"): {"short_name": "VIIRSN_L2_OC", "provider": "OB_DAAC"},
+    ("snpp", "L3m"): {
+        "short_name": "VIIRSN_L3m_CHL",
+        "provider": "OB_DAAC",
+        "search": "DAY.SNPP.CHL.chlor_a.4km",
+    },
+    ("aqua", "L2"): {"short_name": "MODISA_L2_OC", "provider": "OB_DAAC"},
+    ("aqua", "L3m"): {
+        "short_name": "MODISA_L3m_CHL",
+        "provider": "OB_DAAC",
+        "search": "DAY.CHL.chlor_a.4km",
+    },
+    ("terra", "L2"): {"short_name": "MODIST_L2_OC", "provider": "OB_DAAC"},
+    ("terra", "L3m"): {"short_name": "MODIST_L3m_CHL", "provider": "OB_DAAC"},
+}
 
 
 def search_criteria(**kwargs):
@@ -116,40 +208,14 @@ def search_criteria(**kwargs):
       while we would probably be interested in only one.
 
     """
-    assert kwargs["sensor"] in ["seawifs", "aqua", "terra", "snpp"]
-    if kwargs["dtype"] not in ("L2", "L3m"):
-        raise ValueError
-
-    criteria = None
-    if kwargs["sensor"] == "seawifs":
-        if kwargs["dtype"] == "L2":
-            criteria = {"short_name": "SEAWIFS_L2_OC", "provider": "OB_DAAC"}
-    elif kwargs["sensor"] == "snpp":
-        if kwargs["dtype"] == "L2":
-            criteria = {"short_name": "VIIRSN_L2_OC", "provider": "OB_DAAC"}
-        elif kwargs["dtype"] == "L3m":
-            criteria = {
-                "short_name": "VIIRSN_L3m_CHL",
-                "provider": "OB_DAAC",
-                "search": "DAY.SNPP.CHL.chlor_a.4km",
-            }
-    elif kwargs["sensor"] == "aqua":
-        if kwargs["dtype"] == "L2":
-            criteria = {"short_name": "MODISA_L2_OC", "provider": "OB_DAAC"}
-        elif kwargs["dtype"] == "L3m":
-            criteria = {
-                "short_name": "MODISA_L3m_CHL",
-                "provider": "OB_DAAC",
-                "search": "DAY.CHL.chlor_a.4km",
-            }
-    elif kwargs["sensor"] == "terra":
-        if kwargs["dtype"] == "L2":
-            criteria = {"short_name": "MODIST_L2_OC", "provider": "OB_DAAC"}
-        elif kwargs["dtype"] == "L3m":
-            criteria = {"short_name": "MODIST_L3m_CHL", "provider": "OB_DAAC"}
-
-    if criteria is None:
-        raise ValueError
+    try:
+        criteria = CMR_SEARCH_CRITERIA[(kwargs["sensor"], kwargs["dtype"])]
+    except (KeyError, TypeError):
+        raise ValueError(
+            f"No searching criteria for {kwargs['sensor']} {kwargs['dtype']}"
+        )
+    # A copy, so that the table is not modified by the caller
+    criteria = dict(criteria)
 
     module_logger.debug(f"Defined searching criteria: {criteria}")
     return criteria
@@ -219,69 +285,122 @@ def bloom_filter(
     V2019122113000.L2_SNPP_OC.nc
 
     """
-    if isinstance(sensor, list):
-        for s in sensor:
-            module_logger.info(f"Processing a list of sensors. Now: {s}")
-            filenames = bloom_filter(track, s, dtype, dt_tol, dL_tol)
-            yield from filenames
-        return
-
-    # For a spaced track, break it in parts to avoid results in the middle
-    # between valid waypoints.
-    chrono = track.time.sort_values()
-    dt = chrono.diff().abs()
-    if (len(dt) > 1) and (dt.max() > 2 * dt_tol):
-        time_split = chrono.iloc[dt.argmax()]
-        module_logger.debug(
-            "Sparse track. bloom_filter() will split search at: {}".format(
-                time_split
-            )
-        )
-        yield from bloom_filter(
-            track=track[track.time < time_split],
-            sensor=sensor,
-            dtype=dtype,
-            dt_tol=dt_tol,
-            dL_tol=dL_tol,
-        )
-        yield from bloom_filter(
-            track=track[track.time >= time_split],
-            sensor=sensor,
-            dtype=dtype,
-            dt_tol=dt_tol,
-            dL_tol=dL_tol,
-        )
-        return
-
-    stime = datetime64(track.time.min() - dt_tol)
-    etime = datetime64(track.time.max() + dt_tol)
-
-    criteria = search_criteria(sensor=sensor, dtype=dtype)
-
-    rule = criteria.pop("search", None)
-    if rule is not None:
-        rule = re.compile(rule)
+    if isinstance(sensor, str):
+        sensor = [sensor]
 
-    memory = []
     # Temporary solution. Scan each waypoint. To work with a track at once it
     # would require to define a buffer around it, then creating a polygon.
     # Plus it would require to split on space such as it is done on time.
-    for _, p in track.iterrows():
+    # The regions are the same for all sensors, thus defined only once.
+    regions = []
+    for segment in _split_track(track, dt_tol):
+        stime = datetime64(segment.time.min() - dt_tol)
+        etime = datetime64(segment.time.max() + dt_tol)
         temporal = "{},{}".format(
             datetime_as_string(stime, unit="s", timezone="UTC"),
             datetime_as_string(etime, unit="s", timezone="UTC"),
         )
-        circle = f"{p.lon},{p.lat},{dL_tol}"
-        module_logger.debug(f"Searching granules around: {circle}")
-        for g in granules_search(temporal=temporal, circle=circle, **criteria):
-            if (rule is None) or rule.search(g):
-                if g not in memory:
-                    memory.append(g)
-                    module_logger.debug(f"New result from bloom_filter: {g}")
-                    yield g
+        # Repeated positions, such as a mooring, are searched only once
+        circles = dict.fromkeys(
+            f"{p.lon},{p.lat},{dL_tol}"
+            for p in segment.itertuples(index=False)
+        )
+        # A dense segment is searched at once with a bounding box around
+        # all its waypoints. That might include a few extra granules, which
+        # is fine for a bloom filter.
+        bbox = _bounding_box(segment, dL_tol) if len(circles) > 1 else None
+        if bbox is not None:
+            regions.append({"temporal": temporal, "bounding_box": bbox})
+        else:
+            regions.extend(
+                {"temporal": temporal, "circle": c} for c in circles
+            )
+
+    memory = set()
+    # All regions, for all sensors, are searched concurrently, while the
+    # results are yielded by sensor and in chronological order.
+    with ThreadPoolExecutor(max_workers=CMR_WORKERS) as executor:
+        results = []
+        for s in sensor:
+            criteria = search_criteria(sensor=s, dtype=dtype)
+            rule = criteria.pop("search", None)
+            if rule is not None:
+                rule = re.compile(rule)
+            for region in regions:
+                module_logger.debug(f"Searching {s} granules in: {region}")
+                job = executor.submit(_granules_list, **region, **criteria)
+                results.append((rule, job))
+        for rule, r in results:
+            for g in r.result():
+                if (rule is None) or rule.search(g):
+                    if g not in memory:
+                        memory.add(g)
+                        module_logger.debug(
+                            f"New result from bloom_filter: {g}"
+                        )
+                        yield g
     module_logger.debug(f"Finished loop on track (bloom_filter)")
 
 
+def _split_track(track, dt_tol):
+    """Split a spaced track in segments without large gaps in time
+
+    For a spaced track, break it in parts to avoid results in the middle
+    between valid waypoints. Each part is split again at its largest gap
+    while that is longer than twice dt_tol.
+
+    Returns
+    -------
+    list of pd.DataFrame
+        Segments in chronological order
+    """
+    segments = []
+    # Explicit stack of the parts to verify, next one on the top
+    work = [track]
+    while work:
+        segment = work.pop()
+        chrono = segment.time.sort_values()
+        dt = chrono.diff().abs()
+        if (len(dt) > 1) and (dt.max() > 2 * dt_tol):
+            time_split = chrono.iloc[dt.argmax()]
+            module_logger.debug(
+                f"Sparse track. bloom_filter() will split at: {time_split}"
+            )
+            work.append(segment[segment.time >= time_split])
+            work.append(segment[segment.time < time_split])
+        else:
+            segments.append(segment)
+    return segments
+
+
+def _bounding_box(track, dL_tol):
+    """Bounding box around all the waypoints, if small enough
+
+    The box includes the full distance tolerance around each waypoint,
+    thus it covers everything that the individual circles would.
+
+    Returns
+    -------
+    str or None
+        Box as "W,S,E,N", or None if crossing the poles or the antimeridian,
+        or if any side is larger than BBOX_MAX_SIZE degrees.
+    """
+    # Conservative, since one degree of latitude is at least 110.57 km
+    dlat = dL_tol / 110e3
+    south = track.lat.min() - dlat
+    north = track.lat.max() + dlat
+    if (south <= -90) or (north >= 90):
+        return None
+    dlon = dlat / cos(radians(max(abs(south), abs(north))))
+    west = track.lon.min() - dlon
+    east = track.lon.max() + dlon
+    if (west < -180) or (east > 180):
+        return None
+    if max(north - south, east - west) > BBOX_MAX_SIZE:
+        return None
+    return f"{west},{south},{east},{north}"
+
+
 """
     url = "https://cmr.earthdata.nasa.gov/search/granules.umm_json?page_size=30&sort_key=short_name&sort_key=start_date&short_name=MODISA_L2_OC&provider=OB_DAAC&&bounding_box=-10,-5,10,5&temporal=2020-01-03,2020-01-10"
 
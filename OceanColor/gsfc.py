@@ -2,8 +2,14 @@
 Some functionalities that use NASA's GSFC
 """
 
-import json
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
 from typing import Any, Dict, Optional
 from collections.abc import Sequence
 import urllib
@@ -14,9 +20,20 @@ import numpy as np
 import requests
 import requests.compat
 
+from .index import FileIndex
+from .utils import json_loads, oceancolor_cache, requests_session
+
 
 module_logger = logging.getLogger("OceanColor.gsfc")
 
+# Time, in seconds, that a cached file search is considered valid
+FILE_SEARCH_TTL = 24 * 60 * 60
+# Maximum number of concurrent requests to the file search API
+FILE_SEARCH_WORKERS = 8
+
+# Shared by all the file search requests, so that the connections are reused
+_file_search_session = requests_session(pool_maxsize=FILE_SEARCH_WORKERS)
+
 
 def oceandata_file_search(
     sensor: str,
@@ -24,6 +41,8 @@ def oceandata_file_search(
     sdate: Any,
     edate: Optional[Any] = None,
     search: Optional[Any] = None,
+    split: bool = True,
+    ordered: bool = False,
 ) -> Sequence:
     """Search available files with NASA API
 
@@ -34,6 +53,12 @@ def oceandata_file_search(
     sdate: np.datetime64, optional
     edate: np.datettime64, optional
     search: str or list with pattern to search for
+    split: bool, optional
+        Split long L0, L1, and L2 searches in blocks of 60 days, which are
+        requested concurrently. Default is True.
+    ordered: bool, optional
+        Yield the files of each request sorted by filename. Default is
+        False, i.e. in the order returned by the API.
 
     Yields
     ------
@@ -42,12 +67,9 @@ def oceandata_file_search(
 
     Notes
     -----
-    There is an issue encoding the search. There is certainly a more elegant
-    solution for this. An example to work on:
-
-    data = urllib.parse.urlencode({"sensor": "aqua", "sdate": "2020-01-01",
-    "edate": "2020-03-01", "dtype": "L3b", "addurl": 0, "results_as_file": 1,
-    "search": "*DAY_CHL*"})
+    A single search pattern is filtered by NASA's API, thus only the matching
+    files are transferred. Multiple patterns share a single unfiltered
+    request. In both cases the filenames are also verified locally.
 
     Equivalent result can be achieved with wget:
 
@@ -68,29 +90,6 @@ def oceandata_file_search(
     if edate is None:
         edate = np.datetime64("now")
 
-    # Split in blocks if the range is too long.
-    if dtype in ("L0", "L1", "L2"):
-        max_dt = 60
-    else:
-        max_dt = 200
-    block = np.timedelta64(max_dt, "D")
-    if (edate - sdate) > block:
-        for start in np.arange(sdate, edate, block):
-            end = start + block - np.timedelta64(1, "D")
-            filenames = oceandata_file_search(
-                sensor, dtype, start, end, search
-            )
-            yield from filenames
-        return
-
-    if isinstance(search, list):
-        for s in search:
-            filenames = oceandata_file_search(sensor, dtype, sdate, edate, s)
-            yield from filenames
-        return
-
-    search_url = "https://oceandata.sci.gsfc.nasa.gov/api/file_search"
-
     possible_sensors = (
         "aquarius",
         "seawifs",
@@ -112,6 +111,60 @@ def oceandata_file_search(
     if sensor == "snpp":
         sensor = "viirs"
 
+    # Split in blocks if the range is too long. The API handles long ranges
+    # for L3 products, but not for the numerous granules of lower levels.
+    block = np.timedelta64(60, "D")
+    if split and (dtype in ("L0", "L1", "L2")) and ((edate - sdate) > block):
+        periods = [
+            (start, min(start + block - np.timedelta64(1, "D"), edate))
+            for start in np.arange(sdate, edate, block)
+        ]
+    else:
+        periods = [(sdate, edate)]
+
+    if not isinstance(search, list):
+        search = [search]
+    # Multiple patterns are better served by a single unfiltered request
+    pattern = search[0] if len(search) == 1 else None
+
+    # Each block is an independent request, so they are all requested
+    # concurrently, while the results are yielded in chronological order.
+    with ThreadPoolExecutor(max_workers=FILE_SEARCH_WORKERS) as executor:
+        results = [
+            executor.submit(
+                _single_search, sensor, dtype, start, end, pattern
+            )
+            for start, end in periods
+        ]
+        for r in results:
+            filenames = r.result()
+            for s in search:
+                if s is not None:
+                    s = s.replace("*", "")
+                    selected = (k for k in filenames if s in k)
+                else:
+                    selected = filenames
+
+                if ordered:
+                    selected = sorted(selected)
+
+                for f in selected:
+                    output = filenames[f]
+                    output["filename"] = f
+                    yield output
+
+
+def _single_search(
+    sensor: str, dtype: str, sdate, edate, search: Optional[str] = None
+) -> Dict:
+    """A single request to NASA's file search API
+
+    Returns a dictionary of the files available for the given sensor and
+    data type in the period from sdate to edate, indexed by filename. If
+    given, only the files matching the `search` pattern are requested.
+    """
+    search_url = "https://oceandata.sci.gsfc.nasa.gov/api/file_search"
+
     cfg = {
         "sensor": sensor,
         "sdate": np.datetime_as_string(sdate, unit="D"),
@@ -123,26 +176,84 @@ def oceandata_file_search(
         "format": "json",
     }
 
-    # if search is not None:
-    #     cfg["search"] = search
+    if search is not None:
+        cfg["search"] = search
 
     data = urllib.parse.urlencode(cfg).encode("ascii")
 
-    with urllib.request.urlopen(search_url, data) as f:
-        filenames = f.read()
+    return cached_file_search(search_url, data)
 
-    filenames = json.loads(filenames.decode("utf-8"))
 
-    # Temporary solution while search is not working with the request
-    if search is not None:
-        search = search.replace("*", "")
-        for f in [f for f in filenames if search not in f]:
-            del filenames[f]
+def cached_file_search(search_url: str, data: bytes, ttl=None):
+    """Request NASA's file search API using a local cache
 
-    for f in sorted(filenames):
-        output = filenames[f]
-        output["filename"] = f
-        yield output
+    The response for a given request (`data`) is saved in the local cache
+    (see OceanColor.utils.oceancolor_cache) and reused while it is not older
+    than `ttl`, thus avoiding to query NASA's API repeatedly for the same
+    thing.
+
+    Parameters
+    ----------
+    search_url : str
+        NASA's file search API endpoint
+    data : bytes
+        The encoded POST request
+    ttl : int, optional
+        Maximum age, in seconds, of a cached response to be used. Default is
+        FILE_SEARCH_TTL. Use 0 to ignore the cache.
+
+    Returns
+    -------
+    dict
+        The decoded JSON response
+    """
+    if ttl is None:
+        ttl = FILE_SEARCH_TTL
+
+    key = hashlib.sha1(search_url.encode("utf-8") + data).hexdigest()
+    cache_dir = os.path.join(oceancolor_cache(), "file_search")
+    filename = os.path.join(cache_dir, f"{key}.json")
+
+    try:
+        if (time.time() - os.path.getmtime(filename)) < ttl:
+            module_logger.debug(f"Using cached file search: {filename}")
+            with open(filename, "rb") as f:
+                return json_loads(f.read())
+    except (FileNotFoundError, ValueError):
+        pass
+
+    r = _file_search_session.post(
+        search_url,
+        data=data,
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+        timeout=60,
+    )
+    r.raise_for_status()
+    content = r.content
+    filenames = json_loads(content)
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=cache_dir, delete=False) as tmp:
+            tmp.write(content)
+        os.replace(tmp.name, filename)
+    except OSError:
+        module_logger.warning(f"Failed to cache file search at {cache_dir}")
+
+    return filenames
+
+
+# Filename patterns for each (sensor, dtype)
+FILE_SEARCH_CRITERIA = {
+    ("seawifs", "L2"): ("*L2_GAC_OC.nc",),
+    ("seawifs", "L3m"): ("*DAY_CHL_chlor_a_9km*",),
+    ("snpp", "L2"): ("*JPSS1_OC.nc",),
+    ("snpp", "L3m"): ("*DAY_SNPP_CHL_chlor_a_4km.nc",),
+    ("aqua", "L2"): ("*L2_LAC_OC.nc",),
+    ("aqua", "L3m"): ("*DAY_CHL_chlor_a_4km*",),
+    ("terra", "L2"): ("*L2_LAC_OC.nc",),
+    ("terra", "L3m"): ("*DAY_CHL_chlor_a_4km*",),
+}
 
 
 def search_criteria(**kwargs):
@@ -152,21 +263,7 @@ def search_criteria(**kwargs):
     """
     assert kwargs["sensor"] in ["seawifs", "aqua", "terra", "snpp"]
     assert kwargs["dtype"] in ("L2", "L3m")
-    if kwargs["sensor"] == "seawifs":
-        if kwargs["dtype"] == "L2":
-            criteria = ["*L2_GAC_OC.nc"]
-        elif kwargs["dtype"] == "L3m":
-            criteria = ["*DAY_CHL_chlor_a_9km*"]
-    elif kwargs["sensor"] == "snpp":
-        if kwargs["dtype"] == "L2":
-            criteria = ["*JPSS1_OC.nc"]
-        elif kwargs["dtype"] == "L3m":
-            criteria = ["*DAY_SNPP_CHL_chlor_a_4km.nc"]
-    elif kwargs["dtype"] == "L2":
-        criteria = ["*L2_LAC_OC.nc"]
-    elif kwargs["dtype"] == "L3m":
-        criteria = ["*DAY_CHL_chlor_a_4km*"]
-    return criteria
+    return list(FILE_SEARCH_CRITERIA[(kwargs["sensor"], kwargs["dtype"])])
 
 
 """
@@ -202,8 +299,12 @@ def bloom_filter(
     Note
     ----
     - Include time and space resolution (like daily, and 4km or higest)
-    - It should have the option to run with a local cache. Somehow download
-      once a full list (or update a previous list) and work on that.
+    - The available files are recorded in a local index (see
+      OceanColor.index.FileIndex) at the local cache (see
+      OceanColor.utils.oceancolor_cache), thus NASA's API is only requested
+      for the days not searched before, with one filtered search for each
+      pattern and gap. Define the environment variable
+      OCEANCOLOR_FILE_INDEX=0 to disable it.
     - Later include criteria by geolimits.
     """
     if isinstance(sensor, list):
@@ -212,26 +313,73 @@ def bloom_filter(
             yield from filenames
         return
 
-    sdate = np.datetime64(track.time.min() - dt_tol)
-    edate = np.datetime64(track.time.max() + dt_tol)
+    sdate = np.datetime64(track.time.min() - dt_tol, "D")
+    edate = np.datetime64(track.time.max() + dt_tol, "D")
 
     search = search_criteria(sensor=sensor, dtype=dtype)
-    filenames = oceandata_file_search(sensor, dtype, sdate, edate, search)
-    yield from filenames
 
+    index = None
+    if os.getenv("OCEANCOLOR_FILE_INDEX", "1") != "0":
+        try:
+            index = FileIndex()
+        except (OSError, sqlite3.Error):
+            module_logger.warning("Can't use the local file index")
+    if index is None:
+        yield from oceandata_file_search(sensor, dtype, sdate, edate, search)
+        return
+
+    with index:
+        # Each gap is searched on its own, filtered by NASA's API
+        for pattern in search:
+            for start, end in index.gaps(
+                sensor, dtype, sdate, edate, pattern
+            ):
+                module_logger.debug(
+                    f"Updating file index from {start} to {end}"
+                )
+                filenames = oceandata_file_search(
+                    sensor, dtype, start, end, pattern
+                )
+                index.update(sensor, dtype, start, end, filenames, pattern)
+
+        yield from index.search(sensor, dtype, sdate, edate, search)
+
+
+def remote_filesystem(username, password):
+    """HTTP filesystem authenticated with NASA's EarthData credentials
 
-def read_remote_file(filename, username, password):
+    The same filesystem can be used for multiple downloads, reusing its
+    connections and the authentication cookies.
+    """
+    fs = fsspec.filesystem(
+        "https",
+        client_kwargs={"auth": aiohttp.BasicAuth(username, password)},
+        skip_instance_cache=True,
+    )
+    return fs
+
+
+def read_remote_file(filename, username, password, fileobj=None, fs=None):
     """Return the binary content of a NASA data file
 
     NASA now requires authentication to access its data files, thus a username
     and a password.
+
+    If a file-like `fileobj` is given, the content is streamed into it in
+    chunks, instead of being loaded in memory, and nothing is returned.
+
+    An already authenticated filesystem (see remote_filesystem()) can be
+    given with `fs`, so that its connections are reused.
     """
     url_base = "https://oceandata.sci.gsfc.nasa.gov/ob/getfile/"
     url = requests.compat.urljoin(url_base, filename)
 
-    fs = fsspec.filesystem(
-        "https", client_kwargs={"auth": aiohttp.BasicAuth(username, password)}
-    )
-    f = fs.open(url)
-    content = f.read()
-    return content
+    if fs is None:
+        fs = remote_filesystem(username, password)
+    if fileobj is None:
+        with fs.open(url) as f:
+            return f.read()
+
+    # block_size=0 streams the response sequentially
+    with fs.open(url, block_size=0) as f:
+        shutil.copyfileobj(f, fileobj, length=1024 * 1024)
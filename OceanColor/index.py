@@ -0,0 +1,295 @@
+"""Local index of NASA's data files
+
+Keep a record of the files available at NASA for each sensor, data type,
+search pattern, and day already searched, so that repeated searches don't
+need to reach NASA's API again.
+"""
+
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+from typing import Optional
+
+import numpy as np
+
+from .utils import json_loads, oceancolor_cache
+
+
+module_logger = logging.getLogger("OceanColor.index")
+
+# Time, in seconds, that a searched day is considered up to date
+INDEX_TTL = 30 * 24 * 60 * 60
+# Recent days are never considered complete since new files are still
+# being processed by NASA
+INDEX_RECENT = np.timedelta64(7, "D")
+# Version of the database layout. Older databases are rebuilt, since they
+# are only a cache of NASA's API.
+INDEX_SCHEMA = 1
+
+# Date in filenames such as AQUA_MODIS.20190501T100501.L2.OC.nc
+_DATE_RULE = re.compile(r"\.(\d{4})(\d{2})(\d{2})(?:T\d{6}|_\d{8})?\.")
+# Date in old style filenames such as A2019152.L3m_DAY_CHL_chlor_a_4km.nc
+_DOY_RULE = re.compile(r"^[A-Z](\d{4})(\d{3})")
+
+
+def filename_date(filename: str):
+    """Date of a NASA's data file from its name
+
+    Returns None if not recognized.
+
+    Examples
+    --------
+    >>> filename_date("AQUA_MODIS.20190501T100501.L2.OC.nc")
+    numpy.datetime64('2019-05-01')
+    >>> filename_date("A2019152.L3m_DAY_CHL_chlor_a_4km.nc")
+    numpy.datetime64('2019-06-01')
+    """
+    m = _DATE_RULE.search(filename)
+    if m is not None:
+        return np.datetime64("-".join(m.groups()), "D")
+    m = _DOY_RULE.match(filename)
+    if m is not None:
+        year, doy = m.groups()
+        return np.datetime64(year, "D") + np.timedelta64(int(doy) - 1, "D")
+
+
+class FileIndex:
+    """Index of NASA's data files in a local SQLite database
+
+    Each file is recorded with its sensor, data type, search pattern, and
+    date, together with the days that were completely searched, so that only
+    the days not searched yet (gaps) require a new request to NASA's API.
+    Each search pattern is indexed independently, thus NASA's API can filter
+    the files with it.
+
+    Examples
+    --------
+    >>> pattern = "*L2_LAC_OC.nc"
+    >>> with FileIndex() as index:
+    >>>     for start, end in index.gaps("aqua", "L2", sdate, edate, pattern):
+    >>>         files = oceandata_file_search(
+    >>>             "aqua", "L2", start, end, pattern
+    >>>         )
+    >>>         index.update("aqua", "L2", start, end, files, pattern)
+    >>>     for f in index.search("aqua", "L2", sdate, edate, pattern):
+    >>>         print(f["filename"])
+    """
+
+    logger = logging.getLogger("OceanColor.index.FileIndex")
+
+    def __init__(self, dbfilename: Optional[str] = None, ttl=None):
+        """
+        Parameters
+        ----------
+        dbfilename : str, optional
+            SQLite database. Default is file_index.sqlite in the local cache
+            (see OceanColor.utils.oceancolor_cache).
+        ttl : int, optional
+            Maximum age, in seconds, of a searched day to be considered up to
+            date. Default is INDEX_TTL.
+        """
+        if dbfilename is None:
+            cache_dir = oceancolor_cache()
+            os.makedirs(cache_dir, exist_ok=True)
+            dbfilename = os.path.join(cache_dir, "file_index.sqlite")
+        if ttl is None:
+            ttl = INDEX_TTL
+        self.ttl = ttl
+
+        self.logger.debug(f"Using file index: {dbfilename}")
+        self.db = sqlite3.connect(dbfilename)
+        try:
+            self._create_tables()
+        except:
+            self.close()
+            raise
+
+    def _create_tables(self):
+        """Create the tables, rebuilding those with an older layout"""
+        with self.db:
+            (version,) = self.db.execute("PRAGMA user_version").fetchone()
+            if version != INDEX_SCHEMA:
+                self.logger.debug("Rebuilding file index with new layout")
+                self.db.execute("DROP TABLE IF EXISTS files")
+                self.db.execute("DROP TABLE IF EXISTS coverage")
+                self.db.execute(f"PRAGMA user_version = {INDEX_SCHEMA}")
+            self.db.execute(
+                """CREATE TABLE IF NOT EXISTS files (
+                filename TEXT,
+                sensor TEXT,
+                dtype TEXT,
+                search TEXT,
+                date TEXT,
+                metadata TEXT,
+                PRIMARY KEY (sensor, dtype, search, filename))"""
+            )
+            self.db.execute(
+                """CREATE INDEX IF NOT EXISTS files_date
+                ON files (sensor, dtype, search, date)"""
+            )
+            self.db.execute(
+                """CREATE TABLE IF NOT EXISTS coverage (
+                sensor TEXT,
+                dtype TEXT,
+                search TEXT,
+                date TEXT,
+                searched REAL,
+                PRIMARY KEY (sensor, dtype, search, date))"""
+            )
+
+    def close(self):
+        """Close the database
+
+        Safe to call more than once, or on a partially initialized index.
+        """
+        db = getattr(self, "db", None)
+        if db is not None:
+            db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+    def gaps(self, sensor: str, dtype: str, sdate, edate, search=None):
+        """Periods not searched yet, or searched long ago
+
+        Parameters
+        ----------
+        search : str, optional
+            Search pattern, as in OceanColor.gsfc.oceandata_file_search.
+            Default is None, i.e. a search of all files.
+
+        Returns
+        -------
+        list of (np.datetime64, np.datetime64)
+            Start and end dates of each period
+        """
+        sdate = np.datetime64(sdate, "D")
+        edate = np.datetime64(edate, "D")
+        covered = self.db.execute(
+            """SELECT date FROM coverage
+            WHERE sensor = ? AND dtype = ? AND search = ?
+            AND date BETWEEN ? AND ? AND searched >= ?""",
+            (
+                sensor,
+                dtype,
+                search or "",
+                str(sdate),
+                str(edate),
+                time.time() - self.ttl,
+            ),
+        )
+        covered = {np.datetime64(d, "D") for (d,) in covered}
+
+        output = []
+        for day in np.arange(sdate, edate + np.timedelta64(1, "D")):
+            if day in covered:
+                continue
+            if output and (output[-1][1] + np.timedelta64(1, "D") == day):
+                output[-1] = (output[-1][0], day)
+            else:
+                output.append((day, day))
+        return output
+
+    def update(
+        self, sensor: str, dtype: str, sdate, edate, files, search=None
+    ):
+        """Record the files found in a complete search from sdate to edate
+
+        Previous records in that period are replaced. The period is only
+        marked as searched if the date of all files is recognized.
+
+        Parameters
+        ----------
+        files : sequence of dict
+            As returned by OceanColor.gsfc.oceandata_file_search, i.e.
+            including at least the filename.
+        search : str, optional
+            Search pattern used to find those files. Default is None, i.e.
+            a search of all files.
+        """
+        search = search or ""
+        sdate = np.datetime64(sdate, "D")
+        edate = np.datetime64(edate, "D")
+
+        records = []
+        complete = True
+        for f in files:
+            date = filename_date(f["filename"])
+            if date is None:
+                self.logger.warning(f"Unknown date for {f['filename']}")
+                complete = False
+                date = sdate
+            # Date of the search that found it, so it is found again
+            date = min(max(date, sdate), edate)
+            records.append(
+                (
+                    f["filename"],
+                    sensor,
+                    dtype,
+                    search,
+                    str(date),
+                    json.dumps(f),
+                )
+            )
+
+        with self.db:
+            self.db.execute(
+                """DELETE FROM files
+                WHERE sensor = ? AND dtype = ? AND search = ?
+                AND date BETWEEN ? AND ?""",
+                (sensor, dtype, search, str(sdate), str(edate)),
+            )
+            self.db.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                records,
+            )
+            if not complete:
+                return
+            searched = time.time()
+            last = min(edate, np.datetime64("today") - INDEX_RECENT)
+            self.db.executemany(
+                "INSERT OR REPLACE INTO coverage VALUES (?, ?, ?, ?, ?)",
+                [
+                    (sensor, dtype, search, str(day), searched)
+                    for day in np.arange(sdate, last + np.timedelta64(1, "D"))
+                ],
+            )
+
+    def search(self, sensor: str, dtype: str, sdate, edate, search=None):
+        """Files recorded from sdate to edate
+
+        Parameters
+        ----------
+        search : str or list, optional
+            Pattern(s) of the searches that found the files, as given to
+            update().
+
+        Yields
+        ------
+        dict
+            Dictionary including filename
+        """
+        sdate = np.datetime64(sdate, "D")
+        edate = np.datetime64(edate, "D")
+        if not isinstance(search, list):
+            search = [search]
+
+        for s in search:
+            records = self.db.execute(
+                """SELECT metadata FROM files
+                WHERE sensor = ? AND dtype = ? AND search = ?
+                AND date BETWEEN ? AND ?
+                ORDER BY date, filename""",
+                (sensor, dtype, s or "", str(sdate), str(edate)),
+            ).fetchall()
+            for (metadata,) in records:
+                yield json_loads(metadata)
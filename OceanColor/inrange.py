@@ -4,10 +4,16 @@ Resources to extract the satellite pixels that are in range (time and space)
 of given waypoints.
 """
 
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
 import logging
 import threading, queue
 import os
-import time
 from typing import Any, Dict, Optional
 from collections.abc import Sequence
 
@@ -21,6 +27,9 @@ from .backend import FileSystem
 
 module_logger = logging.getLogger("OceanColor.inrange")
 
+# WGS84 ellipsoid, shared by all distance estimates
+_GEOD = Geod(ellps="WGS84")
+
 try:
     from loky import ProcessPoolExecutor
 
@@ -30,6 +39,15 @@ except:
     LOKY_AVAILABLE = False
     module_logger.info("Missing package loky. Falling back to threading.")
 
+try:
+    from numba import njit
+
+    NUMBA_AVAILABLE = True
+    module_logger.debug("Will use package numba to prefilter pixels.")
+except:
+    NUMBA_AVAILABLE = False
+    module_logger.debug("Missing package numba. Prefiltering with NumPy.")
+
 
 class InRange:
     """Search and fetch Ocean Color pixels within range of given waypoints
@@ -145,6 +163,40 @@ class InRange:
         self.logger.debug("Starting scanner worker.")
         self.worker.start()
 
+    def _fetch(self, filenames, n: int = 3):
+        """Fetch granules in advance, yielding them in the same order
+
+        Up to `n` granules are downloaded and loaded in the background while
+        the previous ones are scanned. The downloads are still throttled by
+        OceanColorDB.
+
+        Yields
+        ------
+        (str, xr.Dataset)
+            Filename and the respective granule
+        """
+
+        def fetch(f):
+            self.logger.debug(f"Getting {f}")
+            return self.db[f].compute()
+
+        executor = ThreadPoolExecutor(max_workers=n)
+        pending = deque()
+        try:
+            for f in filenames:
+                pending.append((f, executor.submit(fetch, f)))
+                if len(pending) > n:
+                    f, r = pending.popleft()
+                    yield f, r.result()
+            while pending:
+                f, r = pending.popleft()
+                yield f, r.result()
+        finally:
+            # Same as shutdown(cancel_futures=True), which requires Python 3.9
+            for _, r in pending:
+                r.cancel()
+            executor.shutdown(wait=False)
+
     def download_only(self, track, sensor, dtype, dt_tol, dL_tol):
         filenames = bloom_filter(track, sensor, dtype, dt_tol, dL_tol)
         for f in filenames:
@@ -159,34 +211,29 @@ class InRange:
         filenames = bloom_filter(track, sensor, dtype, dt_tol, dL_tol)
         self.logger.debug("Finished bloom filter")
 
-        results = []
-        for f in filenames:
-            self.logger.info(f"Scanning: {f}")
-            if (len(results) >= npes) and parent.is_alive():
-                idx = [r.is_alive() for r in results]
-                if np.all(idx):
-                    r = results.pop(0)
-                    self.logger.debug(f"Waiting for {r.name}")
-                else:
-                    r = results.pop(idx.index(False))
-                r.join()
-                self.logger.debug(f"Finished {r.name}")
-            self.logger.debug(f"Getting {f}")
-            ds = self.db[f].compute()
-            self.logger.debug(f"Launching search on {f}")
-            if not parent.is_alive():
-                return
-            results.append(
-                threading.Thread(
-                    target=matchup, args=(track, ds, dL_tol, dt_tol, queue)
+        with ThreadPoolExecutor(max_workers=npes) as executor:
+            results = []
+            for f, ds in self._fetch(filenames):
+                self.logger.info(f"Scanning: {f}")
+                if (len(results) >= npes) and parent.is_alive():
+                    done, _ = wait(results, return_when=FIRST_COMPLETED)
+                    for r in done:
+                        results.remove(r)
+                        # Propagate any exception from the matchup
+                        r.result()
+                        self.logger.debug("Finished reading another file")
+                if not parent.is_alive():
+                    return
+                self.logger.debug(f"Launching search on {f}")
+                results.append(
+                    executor.submit(matchup, track, ds, dL_tol, dt_tol, queue)
                 )
-            )
-            results[-1].start()
-        for r in results:
-            if not parent.is_alive():
-                return
-            r.join()
-            self.logger.debug(f"Finished {r.name}")
+
+            for r in as_completed(results, timeout):
+                if not parent.is_alive():
+                    return
+                r.result()
+                self.logger.debug("Finished reading another file")
 
         self.logger.debug("Finished scanning all potential matchups.")
         queue.put("END")
@@ -200,34 +247,37 @@ class InRange:
         filenames = bloom_filter(track, sensor, dtype, dt_tol, dL_tol)
         self.logger.debug("Finished bloom filter")
 
+        # The track is sent once to each worker instead of with every job
         with ProcessPoolExecutor(
-            max_workers=npes, timeout=timeout
+            max_workers=npes,
+            timeout=timeout,
+            initializer=_init_worker,
+            initargs=(track,),
         ) as executor:
             results = []
-            for f in filenames:
+            for f, ds in self._fetch(filenames):
                 self.logger.info(f"Scanning: {f}")
                 if (len(results) >= npes) and parent.is_alive():
-                    idx = [r.done() for r in results]
-                    while not np.any(idx):
-                        time.sleep(1)
-                        idx = [r.done() for r in results]
-                    tmp = results.pop(idx.index(True)).result()
-                    self.logger.debug("Finished reading another file")
-                    if not tmp.empty:
-                        self.logger.warning(f"Found {len(tmp)} matchs")
-                        queue.put(tmp)
-                self.logger.debug(f"Getting {f}")
-                ds = self.db[f].compute()
+                    done, _ = wait(results, return_when=FIRST_COMPLETED)
+                    for r in done:
+                        results.remove(r)
+                        tmp = r.result()
+                        self.logger.debug("Finished reading another file")
+                        if not tmp.empty:
+                            self.logger.warning(f"Found {len(tmp)} matchs")
+                            queue.put(tmp)
                 if not parent.is_alive():
                     return
                 self.logger.debug("Submitting a new inrange process")
                 results.append(
-                    executor.submit(matchup, track, ds, dL_tol, dt_tol)
+                    executor.submit(_matchup_worker, ds, dL_tol, dt_tol)
                 )
 
-            for tmp in (r.result(timeout) for r in results):
+            # Drain the remaining jobs in the order that they complete
+            for r in as_completed(results, timeout):
                 if not parent.is_alive():
                     return
+                tmp = r.result()
                 self.logger.debug("Finished reading another file")
                 if not tmp.empty:
                     self.logger.warning(f"Found {len(tmp)} matchs")
@@ -237,6 +287,21 @@ class InRange:
         queue.put("END")
 
 
+# Track of the current search in a worker process, see _init_worker()
+_worker_track = None
+
+
+def _init_worker(track):
+    """Keep the track in a worker process for all its jobs"""
+    global _worker_track
+    _worker_track = track
+
+
+def _matchup_worker(ds, dL_tol: float, dt_tol):
+    """matchup() of a granule against the track given to _init_worker()"""
+    return matchup(_worker_track, ds, dL_tol, dt_tol)
+
+
 def matchup(track, ds, dL_tol: float, dt_tol, queue=None):
     """Search a granule for pixels within range (time/space) of a track
 
@@ -399,35 +464,44 @@ def matchup_L2(track, ds, dL_tol: float, dt_tol):
     varnames = [v for v in varnames if v not in ("lat", "lon")]
     # ds = ds[varnames]
 
-    g = Geod(ellps="WGS84")  # Use Clarke 1966 ellipsoid.
     assert ds.time.dims == ("number_of_lines",), "Assume time by n of lines"
+    # Whole (cropped) swath at once instead of line by line
+    lon = ds.lon.values
+    lat = ds.lat.values
+    line_time = np.broadcast_to(ds.time.values[:, np.newaxis], lon.shape)
+    # Latitude range of each scan line, a simple spatial index of the swath
+    line_lat_min = np.fmin.reduce(lat, axis=1)
+    line_lat_max = np.fmax.reduce(lat, axis=1)
+    # Load each variable only once, instead of once per waypoint
+    values = {v: ds[v].values for v in varnames}
+    columns = _empty_columns(varnames)
     for i, p in subset.iterrows():
-        for _, grp in ds.groupby("number_of_lines"):
-            # Only sat. Chl within a certain distance.
-            dL = g.inv(
-                grp.lon.data,
-                grp.lat.data,
-                np.ones(grp.lon.shape) * p.lon,
-                np.ones(grp.lat.shape) * p.lat,
-            )[2]
-            idx = dL <= dL_tol
-            if idx.any():
-                # Save the product_name??
-                tmp = {
-                    "waypoint_id": i,
-                    "lon": grp.lon.data[idx],
-                    "lat": grp.lat.data[idx],
-                    "dL": dL[idx].astype("i"),
-                    "dt": pd.to_datetime(grp.time.data) - p.time,
-                }
-
-                for v in varnames:
-                    tmp[v] = grp[v].data[idx]
-
-                tmp = pd.DataFrame(tmp)
-                # Remove rows where all varnames are NaN
-                tmp = tmp[(~tmp[varnames].isna()).any(axis="columns")]
-                output = pd.concat([output, tmp], ignore_index=True)
+        # Only the scan lines that reach the latitude band of the waypoint
+        lines = np.nonzero(
+            (line_lat_min <= p.lat + deg_tol)
+            & (line_lat_max >= p.lat - deg_tol)
+        )[0]
+        # Precise distance only for the pixels around the waypoint
+        near_lines, near_pixels = np.nonzero(
+            _bbox_mask(lon[lines], lat[lines], p.lon, p.lat, deg_tol)
+        )
+        near = (lines[near_lines], near_pixels)
+        # Only sat. Chl within a certain distance.
+        dL = _distance(lon[near], lat[near], p.lon, p.lat)
+        idx = dL <= dL_tol
+        if idx.any():
+            # Position of each matchup pixel in the swath
+            pixels = (near[0][idx], near[1][idx])
+            # Save the product_name??
+            columns["waypoint_id"].append(np.full(pixels[0].size, i))
+            columns["lon"].append(lon[pixels])
+            columns["lat"].append(lat[pixels])
+            columns["dL"].append(dL[idx].astype("i"))
+            columns["dt"].append(line_time[pixels] - p.time.to_datetime64())
+            for v in varnames:
+                columns[v].append(values[v][pixels])
+
+    output = _columns_to_frame(columns, varnames)
 
     if "product_name" in ds.attrs:
         output["product_name"] = ds.product_name
@@ -476,8 +550,6 @@ def matchup_L3m(track, ds, dL_tol: float, dt_tol):
     day if spray measured in the morning or following day if measurement was
     done in the afternoon/evening.
 
-    IDEA: Maybe crop nc by min/max lat and lon before estimate the distances.
-
 
 
     Return all satellite data in range of some profile
@@ -492,9 +564,6 @@ def matchup_L3m(track, ds, dL_tol: float, dt_tol):
          same day of the profile, while dt_tol=12 limits to the day of the
          profile plus the previous day if spray measured in the morning or
          following day if measurement was done in the afternoon/evening.
-
-         IDEA: Maybe crop nc by min/max lat and lon before estimate the
-           distances.
     """
     #    if dt_tol is None:
     #    dt_tol = pd.to_timedelta(0)
@@ -534,8 +603,16 @@ def matchup_L3m(track, ds, dL_tol: float, dt_tol):
     deg_tol = dL_tol / 110e3
     ds = ds.isel(lat=(ds.lat >= subset.lat.min() - deg_tol))
     ds = ds.isel(lat=(ds.lat <= subset.lat.max() + deg_tol))
-
-    Lon, Lat = np.meshgrid(ds.lon[:], ds.lat[:])
+    # Longitudes in range of any waypoint, including across the antimeridian
+    lon = ds.lon.values
+    near = np.zeros(lon.shape, dtype=bool)
+    for lon0, lat0 in zip(subset.lon, subset.lat):
+        lon_tol = _lon_tolerance(lat0, deg_tol)
+        if lon_tol is None:
+            near[:] = True
+            break
+        near |= np.abs((lon - lon0 + 180) % 360 - 180) <= lon_tol
+    ds = ds.isel(lon=near)
 
     varnames = [
         v
@@ -544,21 +621,35 @@ def matchup_L3m(track, ds, dL_tol: float, dt_tol):
     ]
     ds = ds[varnames]
 
-    output = pd.DataFrame()
-    g = Geod(ellps="WGS84")  # Use Clarke 1966 ellipsoid.
+    # Load each variable only once, instead of once per waypoint
+    values = {v: ds[v].values for v in varnames}
+    lon = ds.lon.values
+    lat = ds.lat.values
+    columns = _empty_columns(varnames)
     # Maybe filter
     for i, p in subset.iterrows():
+        # Precise distance only for the pixels around the waypoint. The
+        # grid is regular, so the box is defined by rows and columns.
+        rows = np.flatnonzero(np.abs(lat - p.lat) <= deg_tol)
+        lon_tol = _lon_tolerance(p.lat, deg_tol)
+        if lon_tol is None:
+            cols = np.arange(lon.size)
+        else:
+            cols = np.flatnonzero(
+                np.abs((lon - p.lon + 180) % 360 - 180) <= lon_tol
+            )
+        rows, cols = (
+            x.ravel() for x in np.meshgrid(rows, cols, indexing="ij")
+        )
         # Only sat. Chl within a certain distance.
-        dL = g.inv(
-            Lon, Lat, np.ones(Lon.shape) * p.lon, np.ones(Lat.shape) * p.lat
-        )[2]
+        dL = _distance(lon[cols], lat[rows], p.lon, p.lat)
         idx = dL <= dL_tol
-        tmp = {
-            "waypoint_id": i,
-            "lon": Lon[idx],
-            "lat": Lat[idx],
-            "dL": dL[idx].astype("i"),
-        }
+        # Position of each matchup pixel in the grid
+        pixels = (rows[idx], cols[idx])
+        columns["waypoint_id"].append(np.full(pixels[0].size, i))
+        columns["lon"].append(lon[pixels[1]])
+        columns["lat"].append(lat[pixels[0]])
+        columns["dL"].append(dL[idx].astype("i"))
 
         # What to do if idx is none? Need to do something here and stop earlier
 
@@ -570,15 +661,110 @@ def matchup_L3m(track, ds, dL_tol: float, dt_tol):
         #     tmp['dt'] = p.datetime - time_coverage_end
         # else:
         #     tmp['dt'] = pd.Timedelta(0)
-        tmp["dt"] = time_reference - p.time
+        dt = (time_reference - p.time).to_timedelta64()
+        columns["dt"].append(np.full(pixels[0].size, dt))
 
         for v in varnames:
-            tmp[v] = ds[v].data[idx]
+            columns[v].append(values[v][pixels])
 
-        tmp = pd.DataFrame(tmp)
-        # tmp.dropna(inplace=True)
-        # Remove rows where all varnames are NaN
-        tmp = tmp[(~tmp[varnames].isna()).any(axis="columns")]
-        output = pd.concat([output, tmp], ignore_index=True)
+    return _columns_to_frame(columns, varnames)
 
+
+def _empty_columns(varnames):
+    """Lists to gather the arrays of each matchup column, per waypoint"""
+    return {
+        c: [] for c in ["waypoint_id", "lon", "lat", "dL", "dt"] + varnames
+    }
+
+
+def _columns_to_frame(columns, varnames):
+    """Single DataFrame from the arrays gathered for each waypoint
+
+    Each column is concatenated once, instead of creating and concatenating
+    one DataFrame per waypoint. Rows where all varnames are NaN are removed.
+    """
+    if not columns["waypoint_id"]:
+        return pd.DataFrame()
+
+    output = pd.DataFrame({c: np.concatenate(v) for c, v in columns.items()})
+    output.dropna(subset=varnames, how="all", inplace=True)
+    output.reset_index(drop=True, inplace=True)
     return output
+
+
+def _distance(lon, lat, lon0: float, lat0: float):
+    """Geodesic distance, in meters, from (lon0, lat0) to each position
+
+    The reference position is broadcast instead of replicated in new arrays.
+    """
+    return _GEOD.inv(
+        lon,
+        lat,
+        np.broadcast_to(np.float64(lon0), np.shape(lon)),
+        np.broadcast_to(np.float64(lat0), np.shape(lat)),
+    )[2]
+
+
+def _lon_tolerance(lat0: float, deg_tol: float):
+    """Longitude tolerance equivalent to deg_tol around latitude lat0
+
+    On a sphere, two positions poleward of `lat_max` are at least
+    2 asin(cos(lat_max) sin(dlon/2)) apart, which gives the longitude
+    tolerance. Returns None if any longitude could be in range, such as
+    close to the poles.
+    """
+    lat_max = np.radians(abs(lat0) + deg_tol)
+    ratio = np.sin(np.radians(deg_tol) / 2) / np.cos(lat_max)
+    if (lat_max < np.pi / 2) and (ratio < 1):
+        return 2 * np.degrees(np.arcsin(ratio))
+
+
+def _bbox_mask(lon, lat, lon0: float, lat0: float, deg_tol: float):
+    """Pixels inside a box around (lon0, lat0)
+
+    A cheap prefilter for the geodesic distance. The box contains any pixel
+    that is within `deg_tol`, in degrees of latitude, from the reference
+    position, including across the antimeridian.
+    """
+    lon_tol = _lon_tolerance(lat0, deg_tol)
+    if NUMBA_AVAILABLE:
+        mask = _bbox_kernel(
+            np.ravel(lon),
+            np.ravel(lat),
+            lon0,
+            lat0,
+            deg_tol,
+            -1.0 if lon_tol is None else lon_tol,
+        )
+        return mask.reshape(np.shape(lat))
+
+    mask = np.abs(lat - lat0) <= deg_tol
+    # Longitude only for the few pixels within the latitude band
+    if lon_tol is not None:
+        mask[mask] = np.abs((lon[mask] - lon0 + 180) % 360 - 180) <= lon_tol
+    return mask
+
+
+def _bbox_kernel(lon, lat, lon0, lat0, deg_tol, lon_tol):
+    """Single pass equivalent of _bbox_mask() for flat arrays
+
+    A negative `lon_tol` accepts any longitude. Compiled with numba, if
+    available, to avoid the temporary arrays. The longitude difference is
+    wrapped by branches, much cheaper than a floating point modulo.
+    """
+    mask = np.empty(lat.size, dtype=np.bool_)
+    for i in range(lat.size):
+        inside = abs(lat[i] - lat0) <= deg_tol
+        if inside and (lon_tol >= 0):
+            dlon = lon[i] - lon0
+            while dlon > 180:
+                dlon -= 360
+            while dlon < -180:
+                dlon += 360
+            inside = abs(dlon) <= lon_tol
+        mask[i] = inside
+    return mask
+
+
+if NUMBA_AVAILABLE:
+    _bbox_kernel = njit(cache=True)(_bbox_kernel)
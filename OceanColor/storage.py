@@ -3,20 +3,22 @@
 Different backends allow for different ways to handle the data from NASA.
 """
 
-from datetime import datetime, timedelta
 import logging
-import numpy as np
+import os
 import random
 import tempfile
 import time
 import threading
 
+import h5netcdf
 import xarray as xr
+from xarray.backends import H5NetCDFStore
 
-from .gsfc import read_remote_file
+from .gsfc import read_remote_file, remote_filesystem
 
 # To guarantee backward compatibility
 from .backend import *
+from .backend.common import DASK_AVAILABLE
 
 
 module_logger = logging.getLogger("OceanColor.storage")
@@ -46,10 +48,23 @@ class OceanColorDB:
 
     logger = logging.getLogger("OceanColor.storage.OceanColorDB")
     backend = BaseStorage()
+    # Maximum number of simultaneous downloads
+    max_downloads = 2
+    # One semaphore for each max_downloads, see OceanColorDB.semaphore
+    _semaphores = {}
+    _semaphores_lock = threading.Lock()
+    # Guards next_download, the earliest time.monotonic() allowed to start
+    # the following download
     lock = threading.Lock()
-    time_last_download = datetime(1970, 1, 1)
+    next_download = 0.0
 
-    def __init__(self, username: str, password: str, download: bool = True):
+    def __init__(
+        self,
+        username: str,
+        password: str,
+        download: bool = True,
+        cache_dir: str = None,
+    ):
         """Initializes OceanColorDB
 
         Parameters
@@ -61,11 +76,45 @@ class OceanColorDB:
         download: bool, optional
             Download new data when required, otherwise limits to the already
             available datasets. Default is true, i.e. download when necessary.
+        cache_dir: str, optional
+            Directory to keep the original files as downloaded from NASA, so
+            that they are never downloaded twice. For instance, use
+            os.path.join(OceanColor.utils.oceancolor_cache(), "granules").
+            Default is None, i.e. the downloaded files are discarded once
+            stored in the backend.
         """
         self.logger.debug("Instantiating OceanColorDB")
         self.username = username
         self.password = password
         self.download = download
+        self.cache_dir = cache_dir
+        self._fs = None
+
+    @property
+    def fs(self):
+        """Authenticated filesystem shared by all downloads
+
+        Created on the first use, so that its connections and
+        authentication cookies are reused by the following downloads.
+        """
+        if self._fs is None:
+            self._fs = remote_filesystem(self.username, self.password)
+        return self._fs
+
+    @property
+    def semaphore(self):
+        """Limit the simultaneous downloads to max_downloads
+
+        Created on the first use from the effective max_downloads, which can
+        be customized by subclass or instance. It is shared by all instances
+        with the same max_downloads, so that the limit holds among them.
+        """
+        with OceanColorDB._semaphores_lock:
+            if self.max_downloads not in self._semaphores:
+                self._semaphores[self.max_downloads] = (
+                    threading.BoundedSemaphore(self.max_downloads)
+                )
+            return self._semaphores[self.max_downloads]
 
     def __contains__(self, item: str):
         return item in self.backend
@@ -89,64 +138,153 @@ class OceanColorDB:
 
     def _download(self, index):
         module_logger.debug(f"Downloading from Ocean Color: {index}")
-        # Probably move this reading from remote to another function
-        content = self._remote_content(index)
-        # ds = xr.open_dataset(BytesIO(content))
-        # Seems like it can't read groups using BytesIO
-        with tempfile.NamedTemporaryFile(mode="w+b", delete=True) as tmp:
-            self.logger.debug(f"Saving to temporary file: {tmp.name}")
-            tmp.write(content)
-            tmp.flush()
+        if self.cache_dir is not None:
+            ds = self._open_granule(self._cached_content(index))
+            self.backend[index] = ds
+            return ds
+
+        # Stream the content into a temporary file, so that the whole
+        # granule is never held in memory while downloading. It is closed
+        # before being opened again by name, as required on Windows.
+        with tempfile.NamedTemporaryFile(suffix=".nc", delete=False) as tmp:
+            try:
+                self._remote_content(index, tmp)
+            except:
+                tmp.close()
+                os.remove(tmp.name)
+                raise
+        try:
+            # The temporary file is removed next, thus load it all first
+            ds = self._open_granule(tmp.name)
+            try:
+                ds.load()
+            finally:
+                ds.close()
+        finally:
+            os.remove(tmp.name)
+        self.backend[index] = ds
+        return ds
+
+    def _open_granule(self, filename: str):
+        """Open a granule as downloaded from NASA
+
+        L2 granules are composed by multiple groups that are merged in a
+        single Dataset, with the time of each scan line as a coordinate.
+
+        The HDF5 file handle is owned by the returned Dataset and released by
+        its close().
+        """
+        # Open by path, so HDF5 reads with its native driver instead of
+        # through the Python file object. Parse the HDF5 structure only once
+        # and share that same handle among the root and the L2 groups.
+        h5 = h5netcdf.File(filename, "r")
+        try:
+            # Lazy load with dask if available
+            chunks = {} if DASK_AVAILABLE else None
 
-            ds = xr.open_dataset(tmp.name)
+            ds = xr.open_dataset(H5NetCDFStore(h5), chunks=chunks)
 
             assert ds.processing_level in (
                 "L2",
                 "L3 Mapped",
             ), "I only handle L2 or L3 Mapped"
             if ds.processing_level == "L2":
-                geo = xr.open_dataset(tmp.name, group="geophysical_data")
-                ds = ds.merge(geo)
-                nav = xr.open_dataset(tmp.name, group="navigation_data")
-                ds = ds.merge(nav)
+                geo = xr.open_dataset(
+                    H5NetCDFStore(h5, group="geophysical_data"), chunks=chunks
+                )
+                nav = xr.open_dataset(
+                    H5NetCDFStore(h5, group="navigation_data"), chunks=chunks
+                )
+                # All groups share the same dimensions, so a single merge
+                # without alignment or equality checks is enough.
+                ds = xr.merge(
+                    [ds, geo, nav],
+                    compat="override",
+                    join="override",
+                    combine_attrs="override",
+                )
                 # Maybe include full scan line into ds
-                sline = xr.open_dataset(tmp.name, group="scan_line_attributes")
-                ds["time"] = (
-                    (sline - 1970).year.astype("datetime64[Y]")
-                    + sline.day
-                    - np.timedelta64(1, "D")
-                    + sline.msec
+                sline = xr.open_dataset(
+                    H5NetCDFStore(h5, group="scan_line_attributes"),
+                    decode_timedelta=False,
+                )
+                # Single NumPy expression instead of multiple xarray operations
+                year = sline.year.values
+                day = sline.day.values
+                msec = sline.msec.values
+                line_time = (
+                    (year - 1970).astype("datetime64[Y]")
+                    + (day - 1).astype("timedelta64[D]")
+                    + msec.astype("timedelta64[ms]")
                 )
+                ds = ds.assign_coords(time=("number_of_lines", line_time))
                 ds = ds.rename({"latitude": "lat", "longitude": "lon"})
-            self.backend[index] = ds
+        except:
+            h5.close()
+            raise
+        # A merged Dataset doesn't keep the close() of its parts
+        ds.set_close(h5.close)
         return ds
 
+    def _cached_content(self, filename: str):
+        """Path to the original file in the local cache
+
+        Download it into the cache if not there yet. The content is streamed
+        into a partial file, which is only renamed when complete, thus an
+        interrupted download is never taken as a valid file.
+        """
+        path = os.path.join(self.cache_dir, filename)
+        if os.path.exists(path):
+            self.logger.debug(f"Using cached file: {path}")
+            return path
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            dir=self.cache_dir,
+            prefix=f"{filename}.",
+            suffix=".part",
+            delete=False,
+        ) as tmp:
+            try:
+                self._remote_content(filename, tmp)
+            except:
+                tmp.close()
+                os.remove(tmp.name)
+                raise
+        os.replace(tmp.name, path)
+        return path
+
     def _remote_content(
-        self, filename: str, t_min: int = 4, t_random: int = 4
+        self, filename: str, fileobj=None, t_min: int = 4, t_random: int = 4
     ):
         """Read a remote file with a minimum time between downloads
 
         NASA monitors the downloads and excessive activity is temporarily
-        banned, so this function guarantees a minimum time between downloads
-        to avoid ovoerloading NASA servers.
+        banned, so this function guarantees a minimum time between the start
+        of consecutive downloads to avoid ovoerloading NASA servers. Up to
+        `max_downloads` transfers can be in progress at the same time.
+
+        If `fileobj` is given, the content is streamed into it instead of
+        returned.
         """
-        self.logger.debug("Acquiring lock for remote content")
-        self.lock.acquire()
-        self.logger.debug("Lock acquired")
-        dt = t_min + round(random.random() * t_random, 2)
-        next_time = self.time_last_download + timedelta(seconds=(dt))
-        waiting_time = max((next_time - datetime.now()).total_seconds(), 0)
-        self.logger.debug(
-            f"Waiting {waiting_time} seconds before downloading."
-        )
-        time.sleep(waiting_time)
-        try:
+        with self.semaphore:
+            self.logger.debug("Acquiring lock for remote content")
+            with self.lock:
+                self.logger.debug("Lock acquired")
+                now = time.monotonic()
+                waiting_time = max(self.next_download - now, 0)
+                self.logger.debug(
+                    f"Waiting {waiting_time} seconds before downloading."
+                )
+                time.sleep(waiting_time)
+                dt = t_min + round(random.random() * t_random, 2)
+                OceanColorDB.next_download = now + waiting_time + dt
+                self.logger.debug(f"Next download in at least {dt} seconds")
+
             self.logger.info(f"Downloading: {filename}")
-            content = read_remote_file(filename, self.username, self.password)
-        finally:
-            self.time_last_download = datetime.now()
-            self.logger.debug("remote_content releasing lock")
-            self.lock.release()
+            content = read_remote_file(
+                filename, self.username, self.password, fileobj, fs=self.fs
+            )
 
         return content
 
@@ -1,12 +1,26 @@
 """Miscellaneous utils such as flag mask decoding
 """
 
+import json
 import logging
 import os
 
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
 
 module_logger = logging.getLogger("OceanColor.utils")
 
+try:
+    import orjson
+
+    ORJSON_AVAILABLE = True
+    module_logger.debug("Will use package orjson to parse JSON.")
+except:
+    ORJSON_AVAILABLE = False
+    module_logger.debug("Missing package orjson. Falling back to json.")
+
 
 def oceancolorrc():
     """Path to custom configuration
@@ -29,6 +43,81 @@ def oceancolorrc():
     return path
 
 
+def oceancolor_cache():
+    """Path to the local cache
+
+    Define the path where to keep local copies of metadata, such as the
+    results from NASA's file search API, so that repeated requests do not
+    need to reach NASA's servers again.
+
+    The default path is at the user's home directory .cache/oceancolor, but
+    that can be modified by defining an environment variable
+    OCEANCOLOR_CACHE.
+
+    Example
+    -------
+    >>> print(oceancolor_cache())
+    /Users/guilherme/.cache/oceancolor
+    """
+    path = os.path.expanduser(
+        os.getenv("OCEANCOLOR_CACHE", "~/.cache/oceancolor")
+    )
+    return path
+
+
+def json_loads(content):
+    """Parse a JSON document
+
+    Uses orjson, which is considerably faster for large documents such as
+    the responses from NASA's APIs, if available. Otherwise, falls back to
+    the standard json.
+
+    Parameters
+    ----------
+    content : bytes or str
+        JSON document
+
+    Returns
+    -------
+    The decoded object
+    """
+    if ORJSON_AVAILABLE:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def requests_session(pool_maxsize: int = 10, retries: int = 3):
+    """HTTP session reusing connections and retrying on server errors
+
+    A session keeps its connections alive, thus consecutive requests to the
+    same host skip the TCP and TLS handshakes.
+
+    Parameters
+    ----------
+    pool_maxsize : int, optional
+        Maximum number of connections kept alive for each host. It should be
+        at least the number of threads sharing the session.
+    retries : int, optional
+        Maximum number of retries, with exponential backoff, on connection
+        errors or server errors (5xx).
+
+    Returns
+    -------
+    requests.Session
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=0.5,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=None,
+    )
+    adapter = HTTPAdapter(pool_maxsize=pool_maxsize, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
 def decode_L2_flagmask(flag_mask: int):
     """Decode Ocean Color flag mask
 
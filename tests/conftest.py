@@ -0,0 +1,137 @@
+"""Shared fixtures to replace NASA's services in offline tests
+"""
+
+from collections import OrderedDict
+import json
+
+import pandas as pd
+import pytest
+import requests
+import xarray as xr
+
+from OceanColor import cmr, gsfc, storage
+from OceanColor.storage import OceanColorDB
+
+
+@pytest.fixture
+def file_searches(tmp_path, monkeypatch):
+    """Replace gsfc.oceandata_file_search with one L3m file per day
+
+    The local cache, including the file index, is placed at a temporary
+    directory.
+
+    Returns
+    -------
+    list
+        The (sdate, edate, search) of each search, in order
+    """
+    searches = []
+
+    def oceandata_file_search(sensor, dtype, sdate, edate, search=None):
+        searches.append((sdate, edate, search))
+        for day in pd.date_range(sdate, edate):
+            doy = day.strftime("%Y%j")
+            yield {"filename": f"A{doy}.L3m_DAY_CHL_chlor_a_4km.nc"}
+
+    monkeypatch.setenv("OCEANCOLOR_CACHE", str(tmp_path))
+    monkeypatch.setattr(gsfc, "oceandata_file_search", oceandata_file_search)
+    return searches
+
+
+@pytest.fixture
+def file_search_requests(monkeypatch):
+    """Replace the requests to NASA's file search API
+
+    Returns a function that sets the files answered to every request, as a
+    dictionary indexed by filename, and returns the list of the encoded
+    requests, in order.
+    """
+    data = []
+
+    def answer(filenames):
+        def cached_file_search(search_url, request):
+            data.append(request)
+            return dict(filenames)
+
+        monkeypatch.setattr(gsfc, "cached_file_search", cached_file_search)
+        return data
+
+    return answer
+
+
+@pytest.fixture
+def cmr_requests(monkeypatch):
+    """Replace the requests to CMR with pages built on demand
+
+    Returns a function that sets the page builder, page(offset, page_size),
+    which returns the content and the headers of each response. It returns
+    the list of the parameters of each request, in order.
+    """
+    requested = []
+
+    def answer(page):
+        def get(url, params, timeout):
+            requested.append(dict(params))
+            content, headers = page(params["offset"], params["page_size"])
+            r = requests.Response()
+            r.status_code = 200
+            r._content = json.dumps(content).encode()
+            r.headers.update(headers)
+            return r
+
+        monkeypatch.setattr(cmr._cmr_session, "get", get)
+        return requested
+
+    return answer
+
+
+@pytest.fixture
+def cmr_searches(monkeypatch):
+    """Replace cmr.granules_search, starting with an empty cache
+
+    Returns a function that sets the replacement search, which yields the
+    granules for the given keyword arguments. It returns the list of the
+    keyword arguments of each search, in order.
+    """
+    searches = []
+
+    def answer(search):
+        def granules_search(**kwargs):
+            searches.append(kwargs)
+            yield from search(**kwargs)
+
+        monkeypatch.setattr(cmr, "granules_search", granules_search)
+        monkeypatch.setattr(cmr, "_cmr_cache", OrderedDict())
+        return searches
+
+    return answer
+
+
+@pytest.fixture
+def remote_granule(tmp_path, monkeypatch):
+    """Replace downloads from NASA with a minimalist L3m granule
+
+    The download throttle is also reset.
+
+    Returns
+    -------
+    list
+        Filename of each download, in order
+    """
+    granule = tmp_path / "granule.nc"
+    xr.Dataset(
+        {"chlor_a": (("lat", "lon"), [[0.1, 0.2]])},
+        coords={"lat": [10.0], "lon": [20.0, 21.0]},
+        attrs={"processing_level": "L3 Mapped"},
+    ).to_netcdf(granule, engine="h5netcdf")
+
+    downloads = []
+
+    def read_remote_file(filename, username, password, fileobj, fs):
+        downloads.append(filename)
+        fileobj.write(granule.read_bytes())
+
+    monkeypatch.setattr(storage, "read_remote_file", read_remote_file)
+    monkeypatch.setattr(OceanColorDB, "fs", None)
+    monkeypatch.setattr(OceanColorDB, "next_download", 0.0)
+    return downloads
@@ -0,0 +1,106 @@
+"""Test module catalog
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+try:
+    import tables
+
+    TABLES_AVAILABLE = True
+except:
+    TABLES_AVAILABLE = False
+
+from OceanColor.catalog import Catalog
+
+
+def granule(product_name, lat=(30.0, 40.0), lon=(-130.0, -120.0)):
+    """A minimalist granule with the attributes required by the catalog"""
+    return xr.Dataset(
+        attrs={
+            "product_name": product_name,
+            "instrument": "MODIS",
+            "platform": "Aqua",
+            "date_created": "2019-05-02T00:00:00.000Z",
+            "time_coverage_start": "2019-05-01T10:00:00.000Z",
+            "time_coverage_end": "2019-05-01T10:05:00.000Z",
+            "geospatial_lat_min": lat[0],
+            "geospatial_lat_max": lat[1],
+            "geospatial_lon_min": lon[0],
+            "geospatial_lon_max": lon[1],
+        }
+    )
+
+
+@pytest.mark.skipif(not TABLES_AVAILABLE, reason="Requires PyTables")
+def test_contains(tmp_path):
+    dbfilename = str(tmp_path / "catalog.h5")
+    product_name = "AQUA_MODIS.20190501T100000.L2.OC.nc"
+
+    catalog = Catalog(dbfilename)
+    assert product_name not in catalog
+    catalog.record(granule(product_name))
+    assert product_name in catalog
+    assert "AQUA_MODIS.20190501T100500.L2.OC.nc" not in catalog
+    del catalog
+
+    # Persistent
+    catalog = Catalog(dbfilename)
+    assert product_name in catalog
+    with pytest.raises(AssertionError):
+        catalog.record(granule(product_name))
+
+
+@pytest.mark.skipif(not TABLES_AVAILABLE, reason="Requires PyTables")
+def test_record_many(tmp_path):
+    catalog = Catalog(str(tmp_path / "catalog.h5"))
+    catalog.record(granule("AQUA_MODIS.20190501T100000.L2.OC.nc"))
+
+    product_names = [
+        "AQUA_MODIS.20190501T100500.L2.OC.nc",
+        "AQUA_MODIS.20190501T101000.L2.OC.nc",
+    ]
+    catalog.record_many([granule(p) for p in product_names])
+    assert all(p in catalog for p in product_names)
+    assert len(catalog.store.select("catalog")) == 3
+
+    # Nothing is recorded if any granule is already there
+    with pytest.raises(AssertionError):
+        catalog.record_many(
+            [
+                granule("AQUA_MODIS.20190501T101500.L2.OC.nc"),
+                granule(product_names[0]),
+            ]
+        )
+    assert len(catalog.store.select("catalog")) == 3
+
+
+@pytest.mark.skipif(not TABLES_AVAILABLE, reason="Requires PyTables")
+def test_bloom_filter(tmp_path):
+    catalog = Catalog(str(tmp_path / "catalog.h5"))
+    catalog.record_many(
+        [
+            granule("AQUA_MODIS.20190501T100000.L2.OC.nc"),
+            granule("AQUA_MODIS.20190501T100500.L2.OC.nc", lat=(50.0, 60.0)),
+            granule("AQUA_MODIS.20190501T101000.L2.OC.nc", lon=(0.0, 10.0)),
+            # Crossing the antimeridian
+            granule(
+                "AQUA_MODIS.20190501T101500.L2.OC.nc", lon=(170.0, -170.0)
+            ),
+        ]
+    )
+
+    track = pd.DataFrame(
+        [{"time": np.datetime64("2019-05-01 11:00"), "lat": 35, "lon": -125}]
+    )
+    ans = list(catalog.bloom_filter(track, dt_tol=np.timedelta64(1, "h")))
+    assert ans == [
+        "AQUA_MODIS.20190501T100000.L2.OC.nc",
+        "AQUA_MODIS.20190501T101500.L2.OC.nc",
+    ]
+
+    # Out of time range
+    ans = catalog.bloom_filter(track, dt_tol=np.timedelta64(30, "m"))
+    assert list(ans) == []
@@ -2,11 +2,15 @@
 
 """Tests for `OceanColor` package."""
 
+import time
+
 from numpy import datetime64, timedelta64
 import pandas as pd
 import pytest
 
+from OceanColor import cmr
 from OceanColor.cmr import (
+    _split_track,
     api_walk,
     bloom_filter,
     granules_search,
@@ -28,6 +32,37 @@ def test_api_walk():
         r
 
 
+def test_api_walk_pages(cmr_requests):
+    """Walk through all pages until the total number of hits"""
+
+    def page(offset, page_size):
+        items = list(range(offset, min(offset + page_size, 5)))
+        return {"hits": 5, "items": items}, {}
+
+    requests = cmr_requests(page)
+
+    src = "https://cmr.earthdata.nasa.gov/search/granules.umm_json"
+    assert list(api_walk(src, page_size=2)) == [0, 1, 2, 3, 4]
+    assert [r["offset"] for r in requests] == [0, 2, 4]
+
+
+def test_api_walk_feed(cmr_requests):
+    """Walk through pages in the Atom format"""
+
+    def page(offset, page_size):
+        entry = [
+            {"producer_granule_id": f"A{i}.L2.nc"}
+            for i in range(offset, min(offset + page_size, 3))
+        ]
+        return {"feed": {"entry": entry}}, {"CMR-Hits": "3"}
+
+    cmr_requests(page)
+
+    src = "https://cmr.earthdata.nasa.gov/search/granules.json"
+    results = [r["producer_granule_id"] for r in api_walk(src, page_size=2)]
+    assert results == ["A0.L2.nc", "A1.L2.nc", "A2.L2.nc"]
+
+
 def test_granules_search():
     for g in granules_search(
         short_name="MODISA_L2_OC",
@@ -85,6 +120,82 @@ def test_bloom_filter_unique():
     assert len(results) == len(set(results)), "Duplicates from bloom_filter"
 
 
+def test_bloom_filter_order(cmr_searches):
+    """Results in the order of the track, without duplicates"""
+
+    def search(circle, **kwargs):
+        lon = float(circle.split(",")[0])
+        # The first waypoint takes longer to respond
+        time.sleep(0.1 * (lon == 38))
+        yield f"A{lon}.L2.nc"
+        yield "A-shared.L2.nc"
+
+    cmr_searches(search)
+
+    track = pd.DataFrame(
+        [
+            {"time": datetime64("2019-05-01"), "lat": 18, "lon": 38},
+            {"time": datetime64("2019-05-01"), "lat": 18, "lon": 48},
+        ]
+    )
+    search = bloom_filter(
+        track,
+        sensor="aqua",
+        dtype="L2",
+        dt_tol=timedelta64(24, "h"),
+        dL_tol=10e3,
+    )
+    assert list(search) == ["A38.0.L2.nc", "A-shared.L2.nc", "A48.0.L2.nc"]
+
+
+def test_bloom_filter_dense_track(cmr_searches):
+    """A dense track is searched at once with a bounding box"""
+    searches = cmr_searches(lambda **kwargs: ["A2019121.L2.nc"])
+
+    track = pd.DataFrame(
+        [
+            {"time": datetime64("2019-05-01 00:00"), "lat": 18, "lon": 38},
+            {"time": datetime64("2019-05-01 01:00"), "lat": 18.1, "lon": 38.1},
+            {"time": datetime64("2019-05-01 02:00"), "lat": 18.2, "lon": 38.2},
+        ]
+    )
+    search = bloom_filter(track, "aqua", "L2", timedelta64(24, "h"), 10e3)
+    assert list(search) == ["A2019121.L2.nc"]
+    assert len(searches) == 1
+    bbox = searches[0]["bounding_box"]
+    west, south, east, north = (float(v) for v in bbox.split(","))
+    assert (west < 38 - 0.09) and (east > 38.2 + 0.09)
+    assert (south < 18 - 0.09) and (north > 18.2 + 0.09)
+
+
+def test_bloom_filter_cache(cmr_searches, monkeypatch):
+    """Repeated searches are answered from memory"""
+    searches = cmr_searches(lambda **kwargs: ["A2019121.L2.nc"])
+
+    # Repeated positions are searched only once
+    track = pd.DataFrame(
+        [
+            {"time": datetime64("2019-05-01 00:00"), "lat": 18, "lon": 38},
+            {"time": datetime64("2019-05-01 06:00"), "lat": 18, "lon": 38},
+        ]
+    )
+    for _ in range(2):
+        search = bloom_filter(
+            track,
+            sensor="aqua",
+            dtype="L2",
+            dt_tol=timedelta64(24, "h"),
+            dL_tol=10e3,
+        )
+        assert list(search) == ["A2019121.L2.nc"]
+    assert len(searches) == 1
+
+    # Expired
+    monkeypatch.setattr(cmr, "CMR_CACHE_TTL", -1)
+    list(bloom_filter(track, "aqua", "L2", timedelta64(24, "h"), 10e3))
+    assert len(searches) == 2
+
+
 def test_bloom_filter_spaced_target():
     track = [
         {"time": datetime64("2019-05-01 12:00:00"), "lat": 18, "lon": 38},
@@ -105,6 +216,47 @@ def test_bloom_filter_spaced_target():
     assert len(results) == 3
 
 
+def test_split_track():
+    """Spaced tracks are split in chronological segments"""
+    track = [
+        {"time": datetime64("2019-05-15 12:00:00"), "lat": 18, "lon": 38},
+        {"time": datetime64("2019-05-01 12:00:00"), "lat": 18, "lon": 38},
+        {"time": datetime64("2019-05-05 12:00:00"), "lat": 18, "lon": 38},
+        {"time": datetime64("2019-05-15 13:00:00"), "lat": 18, "lon": 38},
+    ]
+    track = pd.DataFrame(track, index=[100, 0, 10, 101])
+    segments = _split_track(track, dt_tol=timedelta64(6, "h"))
+    assert [s.index.tolist() for s in segments] == [[0], [10], [100, 101]]
+
+    segments = _split_track(track, dt_tol=timedelta64(10, "D"))
+    assert len(segments) == 1
+
+
+def test_bloom_filter_sensors_offline(cmr_searches):
+    """Multiple sensors are searched together, yielded by sensor"""
+
+    def search(short_name, circle, **kwargs):
+        yield f"{short_name}.{circle}"
+
+    cmr_searches(search)
+
+    track = pd.DataFrame(
+        [
+            {"time": datetime64("2019-05-01"), "lat": 18, "lon": 38},
+            {"time": datetime64("2019-05-03"), "lat": 18, "lon": 39},
+        ]
+    )
+    search = bloom_filter(
+        track, ("aqua", "terra"), "L2", timedelta64(6, "h"), 10e3
+    )
+    assert list(search) == [
+        "MODISA_L2_OC.38,18,10000.0",
+        "MODISA_L2_OC.39,18,10000.0",
+        "MODIST_L2_OC.38,18,10000.0",
+        "MODIST_L2_OC.39,18,10000.0",
+    ]
+
+
 def test_bloom_multiple_sensors():
     track = [{"time": datetime64("2019-05-01"), "lat": 18, "lon": 38}]
     filter = bloom_filter(
@@ -126,6 +278,10 @@ def test_search_criteria():
     assert search["short_name"] == "MODISA_L3m_CHL"
     assert search["provider"] == "OB_DAAC"
 
+    # Modifying the criteria doesn't affect the next ones
+    search.pop("search")
+    assert "search" in search_criteria(sensor="aqua", dtype="L3m")
+
 
 def test_search_criteria_nonexistent_key():
     with pytest.raises(ValueError):
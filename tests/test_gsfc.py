@@ -4,7 +4,9 @@
 
 import pytest
 import numpy as np
+import requests
 
+from OceanColor import gsfc
 from OceanColor.gsfc import oceandata_file_search
 
 
@@ -22,3 +24,96 @@ def test_nasa_file_search():
     )
     ans = "AQUA_MODIS.20190601.L3m.DAY.CHL.chlor_a.4km.nc"
     assert ans in [f["filename"] for f in file_list]
+
+
+def test_cached_file_search(tmp_path, monkeypatch):
+    """Repeated file searches should be answered by the local cache"""
+    calls = []
+
+    def fake_post(url, data, **kwargs):
+        calls.append(data)
+        r = requests.Response()
+        r.status_code = 200
+        r._content = b'{"A2019152.L3m_DAY_CHL_chlor_a_4km.nc": {}}'
+        return r
+
+    monkeypatch.setenv("OCEANCOLOR_CACHE", str(tmp_path))
+    monkeypatch.setattr(gsfc._file_search_session, "post", fake_post)
+
+    url = "https://oceandata.sci.gsfc.nasa.gov/api/file_search"
+    ans = {"A2019152.L3m_DAY_CHL_chlor_a_4km.nc": {}}
+    assert gsfc.cached_file_search(url, b"sensor=aqua") == ans
+    assert gsfc.cached_file_search(url, b"sensor=aqua") == ans
+    assert len(calls) == 1
+
+    # A different request, or an expired cache, reaches the API again
+    gsfc.cached_file_search(url, b"sensor=terra")
+    assert len(calls) == 2
+    gsfc.cached_file_search(url, b"sensor=aqua", ttl=0)
+    assert len(calls) == 3
+
+
+def test_file_search_blocks(file_search_requests):
+    """Long L2 searches are split in blocks, but not L3m"""
+    requests = file_search_requests({})
+
+    sdate = np.datetime64("2019-01-01")
+    edate = np.datetime64("2019-06-01")
+    list(oceandata_file_search("aqua", "L2", sdate, edate))
+    assert len(requests) == 3
+
+    requests.clear()
+    list(oceandata_file_search("aqua", "L3m", sdate, edate))
+    assert len(requests) == 1
+
+    # Multiple patterns share the same request
+    requests.clear()
+    list(oceandata_file_search("aqua", "L2", sdate, edate, ["*OC*", "*SST*"]))
+    assert len(requests) == 3
+    assert all(b"search=" not in data for data in requests)
+
+    # A single pattern is filtered by the API
+    requests.clear()
+    list(oceandata_file_search("aqua", "L3m", sdate, edate, "*DAY_CHL*"))
+    assert len(requests) == 1
+    assert b"search=%2ADAY_CHL%2A" in requests[0]
+
+
+def test_file_search_pattern(file_search_requests):
+    """Only filenames matching the search pattern are returned"""
+    file_search_requests(
+        {
+            "AQUA_MODIS.20190601.L3m.DAY.CHL.chlor_a.4km.nc": {},
+            "AQUA_MODIS.20190601.L3m.DAY.CHL.chlor_a.9km.nc": {},
+            "AQUA_MODIS.20190601.L3m.8D.CHL.chlor_a.4km.nc": {},
+        }
+    )
+
+    file_list = oceandata_file_search(
+        "aqua",
+        "L3m",
+        np.datetime64("2019-06-01"),
+        np.datetime64("2019-06-01"),
+        "*DAY.CHL.chlor_a.4km*",
+    )
+    assert [f["filename"] for f in file_list] == [
+        "AQUA_MODIS.20190601.L3m.DAY.CHL.chlor_a.4km.nc"
+    ]
+
+
+def test_file_search_ordered(file_search_requests):
+    """Sorting by filename is optional"""
+    expected = [
+        "AQUA_MODIS.20190602.L3m.DAY.CHL.chlor_a.4km.nc",
+        "AQUA_MODIS.20190601.L3m.DAY.CHL.chlor_a.4km.nc",
+    ]
+    file_search_requests({f: {} for f in expected})
+
+    sdate = np.datetime64("2019-06-01")
+    edate = np.datetime64("2019-06-02")
+    file_list = oceandata_file_search("aqua", "L3m", sdate, edate)
+    assert [f["filename"] for f in file_list] == expected
+    file_list = oceandata_file_search(
+        "aqua", "L3m", sdate, edate, ordered=True
+    )
+    assert [f["filename"] for f in file_list] == sorted(expected)
@@ -0,0 +1,172 @@
+"""Test module index
+"""
+
+import gc
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from OceanColor import gsfc
+from OceanColor.index import FileIndex, filename_date
+
+
+def test_filename_date():
+    for filename, ans in (
+        ("AQUA_MODIS.20190501T100501.L2.OC.nc", "2019-05-01"),
+        ("SNPP_VIIRS.20190514.L3m.DAY.SNPP.CHL.chlor_a.4km.nc", "2019-05-14"),
+        (
+            "AQUA_MODIS.20190601_20190608.L3m.8D.CHL.chlor_a.4km.nc",
+            "2019-06-01",
+        ),
+        ("A2019152.L3m_DAY_CHL_chlor_a_4km.nc", "2019-06-01"),
+        ("V2018007000000.L2_SNPP_OC.nc", "2018-01-07"),
+    ):
+        assert filename_date(filename) == np.datetime64(ans)
+
+    assert filename_date("unknown.nc") is None
+
+
+def test_gaps(tmp_path):
+    index = FileIndex(str(tmp_path / "index.sqlite"))
+    sdate = np.datetime64("2019-05-01")
+    edate = np.datetime64("2019-05-10")
+    assert index.gaps("aqua", "L2", sdate, edate) == [(sdate, edate)]
+
+    files = [
+        {"filename": "AQUA_MODIS.20190502T100501.L2.OC.nc"},
+        {"filename": "AQUA_MODIS.20190503T100501.L2.OC.nc"},
+    ]
+    index.update("aqua", "L2", "2019-05-02", "2019-05-04", files)
+    assert index.gaps("aqua", "L2", sdate, edate) == [
+        (sdate, sdate),
+        (np.datetime64("2019-05-05"), edate),
+    ]
+    # Independent for each sensor, data type, and search pattern
+    assert index.gaps("terra", "L2", sdate, edate) == [(sdate, edate)]
+    assert index.gaps("aqua", "L2", sdate, edate, "*OC*") == [(sdate, edate)]
+
+    assert list(index.search("aqua", "L2", sdate, edate)) == files
+    assert list(index.search("aqua", "L2", "2019-05-03", edate)) == files[1:]
+    assert list(index.search("aqua", "L2", sdate, edate, "*OC*")) == []
+
+    index.update("aqua", "L2", sdate, edate, files[1:], "*OC*")
+    assert index.gaps("aqua", "L2", sdate, edate, "*OC*") == []
+    assert list(index.search("aqua", "L2", sdate, edate, "*OC*")) == files[1:]
+    # Searches of all files are not affected
+    assert list(index.search("aqua", "L2", sdate, edate)) == files
+
+    # Expired
+    index.ttl = -1
+    assert index.gaps("aqua", "L2", sdate, edate) == [(sdate, edate)]
+
+
+def test_schema(tmp_path):
+    """An index with an older layout is rebuilt"""
+    dbfilename = str(tmp_path / "index.sqlite")
+    db = sqlite3.connect(dbfilename)
+    with db:
+        db.execute("CREATE TABLE files (filename TEXT PRIMARY KEY)")
+        db.execute("INSERT INTO files VALUES ('A2019152.L3m.nc')")
+    db.close()
+
+    index = FileIndex(dbfilename)
+    sdate = np.datetime64("2019-06-01")
+    assert list(index.search("aqua", "L3m", sdate, sdate)) == []
+    index.update("aqua", "L3m", sdate, sdate, [{"filename": "A2019152.nc"}])
+    assert index.gaps("aqua", "L3m", sdate, sdate) == []
+
+
+def test_gaps_unknown_date(tmp_path):
+    """A period with unrecognized filenames is not taken as searched"""
+    index = FileIndex(str(tmp_path / "index.sqlite"))
+    sdate = np.datetime64("2019-05-01")
+    index.update("aqua", "L2", sdate, sdate, [{"filename": "unknown.nc"}])
+    assert index.gaps("aqua", "L2", sdate, sdate) == [(sdate, sdate)]
+    files = index.search("aqua", "L2", sdate, sdate)
+    assert [f["filename"] for f in files] == ["unknown.nc"]
+
+
+def test_close(tmp_path):
+    sdate = np.datetime64("2019-05-01")
+    with FileIndex(str(tmp_path / "index.sqlite")) as index:
+        assert index.gaps("aqua", "L2", sdate, sdate) == [(sdate, sdate)]
+    with pytest.raises(sqlite3.ProgrammingError):
+        index.gaps("aqua", "L2", sdate, sdate)
+    index.close()
+
+
+@pytest.mark.filterwarnings("error::pytest.PytestUnraisableExceptionWarning")
+def test_unavailable(tmp_path):
+    """Only the original error if the database can't be opened"""
+    with pytest.raises(sqlite3.OperationalError):
+        FileIndex(str(tmp_path / "missing" / "index.sqlite"))
+    gc.collect()
+
+
+def test_bloom_filter_index(file_searches):
+    """bloom_filter only searches NASA for days not indexed yet"""
+    track = pd.DataFrame(
+        [{"time": np.datetime64("2019-06-05 12:00"), "lat": 34, "lon": -126}]
+    )
+    dt_tol = np.timedelta64(36, "h")
+    files = list(gsfc.bloom_filter(track, "aqua", "L3m", dt_tol))
+    assert len(files) == 4
+    assert len(file_searches) == 1
+
+    # Repeated search is answered by the index
+    assert list(gsfc.bloom_filter(track, "aqua", "L3m", dt_tol)) == files
+    assert len(file_searches) == 1
+
+    # Only the new days are requested
+    track.loc[0, "time"] = np.datetime64("2019-06-07 12:00")
+    files = list(gsfc.bloom_filter(track, "aqua", "L3m", dt_tol))
+    assert len(files) == 4
+    assert file_searches[-1][:2] == (
+        np.datetime64("2019-06-08"),
+        np.datetime64("2019-06-09"),
+    )
+
+
+def test_bloom_filter_gaps(file_searches):
+    """Each gap in the index is a separate search filtered by NASA's API"""
+    dt_tol = np.timedelta64(12, "h")
+    for day in ("2019-06-03", "2019-06-07"):
+        track = pd.DataFrame(
+            [{"time": np.datetime64(f"{day}T12:00"), "lat": 34, "lon": -126}]
+        )
+        list(gsfc.bloom_filter(track, "aqua", "L3m", dt_tol))
+    file_searches.clear()
+
+    # Indexed from 06-03 to 06-04, and from 06-07 to 06-08
+    track = pd.DataFrame(
+        [
+            {"time": np.datetime64("2019-06-01T12:00"), "lat": 34, "lon": 0},
+            {"time": np.datetime64("2019-06-09T12:00"), "lat": 35, "lon": 0},
+        ]
+    )
+    files = list(gsfc.bloom_filter(track, "aqua", "L3m", dt_tol))
+    assert len(files) == 10
+    pattern = "*DAY_CHL_chlor_a_4km*"
+    assert file_searches == [
+        (np.datetime64(sdate), np.datetime64(edate), pattern)
+        for sdate, edate in (
+            ("2019-06-01", "2019-06-02"),
+            ("2019-06-05", "2019-06-06"),
+            ("2019-06-09", "2019-06-10"),
+        )
+    ]
+
+
+def test_bloom_filter_no_index(file_searches, monkeypatch, tmp_path):
+    """The local index can be disabled"""
+    monkeypatch.setenv("OCEANCOLOR_FILE_INDEX", "0")
+    track = pd.DataFrame(
+        [{"time": np.datetime64("2019-06-05 12:00"), "lat": 34, "lon": -126}]
+    )
+    dt_tol = np.timedelta64(12, "h")
+    for _ in range(2):
+        list(gsfc.bloom_filter(track, "aqua", "L3m", dt_tol))
+    assert len(file_searches) == 2
+    assert not (tmp_path / "file_index.sqlite").exists()
@@ -4,14 +4,17 @@
 from datetime import datetime
 import tempfile
 
+import numpy as np
 from numpy import datetime64, timedelta64
 import os
 
 import pandas as pd
 from pandas import DataFrame
 import pytest
+from pyproj import Geod
 
-from OceanColor.inrange import matchup_L2, matchup_L3m, matchup
+from OceanColor import inrange
+from OceanColor.inrange import matchup_L2, matchup_L3m, matchup, _bbox_mask
 from OceanColor.storage import OceanColorDB, FileSystem
 from OceanColor.OceanColor import InRange
 
@@ -35,6 +38,26 @@ def test_matchup_L2():
     assert data.index.size == 448
 
 
+@pytest.mark.parametrize("numba", [True, False])
+@pytest.mark.parametrize(
+    "lat0,lon0", [(34, -126), (60, 179.99), (60, -179.99), (-85, 10)]
+)
+def test_bbox_mask(lat0, lon0, numba, monkeypatch):
+    """The prefilter box must contain all pixels within range"""
+    monkeypatch.setattr(inrange, "NUMBA_AVAILABLE", numba)
+    Lon, Lat = np.meshgrid(
+        np.arange(-180, 180, 0.25), np.arange(-90, 90, 0.25)
+    )
+    dL_tol = 50e3
+    dL = Geod(ellps="WGS84").inv(
+        Lon, Lat, np.ones(Lon.shape) * lon0, np.ones(Lat.shape) * lat0
+    )[2]
+    mask = _bbox_mask(Lon, Lat, lon0, lat0, dL_tol / 110e3)
+    assert mask[dL <= dL_tol].all()
+    # And it should be a small fraction of the whole grid
+    assert mask.sum() < 10 * (dL <= dL_tol).sum()
+
+
 @pytest.mark.skip()
 def test_matchup_L2_day_line():
     """Test nearby the international day line from both sides"""
@@ -5,6 +5,7 @@
 import os
 import pickle
 
+import h5netcdf
 import pytest
 import xarray as xr
 
@@ -17,6 +18,7 @@ except:
 
 from OceanColor.backend.common import parse_filename
 from OceanColor.backend import FileSystem, S3Storage, InMemory
+from OceanColor import storage
 from OceanColor.storage import OceanColorDB
 
 
@@ -117,6 +119,70 @@ def test_no_download():
     raise
 
 
+def test_cache_dir(tmp_path, remote_granule):
+    """Original files in the cache are not downloaded again"""
+    filename = "TERRA_MODIS.20040107.L3m.DAY.CHL.chlor_a.4km.nc"
+    cache_dir = tmp_path / "cache"
+
+    for i in range(2):
+        db = OceanColorDB("username", "password", cache_dir=str(cache_dir))
+        backend = tmp_path / f"backend_{i}"
+        backend.mkdir()
+        db.backend = FileSystem(str(backend))
+        ds = db[filename]
+        assert ds.chlor_a.shape == (1, 2)
+
+    assert remote_granule == [filename]
+    assert os.listdir(cache_dir) == [filename]
+
+
+def test_max_downloads():
+    """The download semaphore follows the effective max_downloads"""
+    db = OceanColorDB("username", "password")
+    assert db.semaphore is OceanColorDB("username", "password").semaphore
+
+    db.max_downloads = 5
+    for _ in range(5):
+        assert db.semaphore.acquire(blocking=False)
+    assert not db.semaphore.acquire(blocking=False)
+    for _ in range(5):
+        db.semaphore.release()
+
+
+def test_download_releases_handles(tmp_path, remote_granule, monkeypatch):
+    """No open HDF5 handle nor temporary file is left after a download"""
+    filename = "TERRA_MODIS.20040107.L3m.DAY.CHL.chlor_a.4km.nc"
+    handles = []
+
+    class File(h5netcdf.File):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            handles.append(self)
+
+    monkeypatch.setattr(storage.h5netcdf, "File", File)
+    tmpdir = tmp_path / "tmp"
+    tmpdir.mkdir()
+    monkeypatch.setattr(storage.tempfile, "tempdir", str(tmpdir))
+
+    # Temporary download
+    db = OceanColorDB("username", "password")
+    db.backend = InMemory()
+    ds = db[filename]
+    assert ds.chlor_a.values.tolist() == [[0.1, 0.2]]
+    assert len(handles) == 1
+    assert all(h._closed for h in handles)
+    assert os.listdir(tmpdir) == []
+
+    # Cached download, owned by the Dataset until closed
+    monkeypatch.setattr(OceanColorDB, "next_download", 0.0)
+    db = OceanColorDB("username", "password", cache_dir=str(tmp_path / "c"))
+    db.backend = InMemory()
+    ds = db[filename]
+    assert not handles[-1]._closed
+    ds.close()
+    assert all(h._closed for h in handles)
+
+
 # @pytest.mark.skipif(not S3FS_AVAILABLE, reason="S3Storage is not available without s3fs")
 @pytest.mark.skip()
 def test_S3Storage_path():
@@ -158,3 +224,41 @@ def test_inmemory_at_least_one():
     db["test-1"] = ds
 
     assert "test-1" in db
+
+
+def test_inmemory_nbytes():
+    """Total bytes follow insertions, replacements, and evictions"""
+    ds = xr.Dataset({"x": [1, 2, 3]})
+    db = InMemory(quota=2 * ds.nbytes)
+    assert db.nbytes == 0
+    db["test-1"] = ds
+    db["test-1"] = ds
+    assert db.nbytes == ds.nbytes
+    db["test-2"] = ds
+    db["test-3"] = ds
+    assert db.nbytes == 2 * ds.nbytes
+
+
+def test_inmemory_independent():
+    """Each InMemory instance has its own storage"""
+    db1 = InMemory()
+    db2 = InMemory()
+    db1["test-1"] = xr.Dataset({"x": [1, 2, 3]})
+
+    assert "test-1" in db1
+    assert "test-1" not in db2
+
+
+def test_inmemory_threads():
+    """Concurrent insertions keep the total bytes consistent"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    ds = xr.Dataset({"x": [1, 2, 3]})
+    db = InMemory(quota=10 * ds.nbytes)
+
+    def store(i):
+        db[f"test-{i % 20}"] = ds
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(store, range(2000)))
+    assert db.nbytes == 10 * ds.nbytes